@@ -0,0 +1,62 @@
+import json  # For the manifest of a directory
+import os  # For the directories of the arrays
+import shutil  # For the removal of an old directory
+import tempfile  # For a temporary directory of every process
+
+import numpy as np  # For the arrays and their memory maps
+
+# Directories of arrays on disk, like the feature store and the neighbour index
+# Every array is a .npy file, so every run and every worker opens it with a memory map,
+# and a manifest says what the arrays were built from
+MANIFEST_FILE = "manifest.json"
+
+
+def array_file(directory, name):
+    return os.path.join(directory, name + ".npy")
+
+
+# Write the arrays and the manifest to a directory
+# They are written to a temporary directory first, so a half written directory is never used
+# Every process gets its own temporary directory, so processes that build the same arrays at once don't remove
+# each other's files, and the first one that finishes wins
+def save_arrays(directory, arrays, manifest):
+
+    directory = directory.rstrip("/")
+    parent = os.path.dirname(directory) or "."
+    os.makedirs(parent, exist_ok=True)
+
+    temp_directory = tempfile.mkdtemp(prefix=os.path.basename(directory) + ".", suffix=".tmp", dir=parent)
+
+    try:
+        for name, value in arrays.items():
+            np.save(array_file(temp_directory, name), value)
+
+        with open(os.path.join(temp_directory, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        try:
+            os.replace(temp_directory, directory)
+        except OSError:
+            # Another process saved the directory between the removal and the replace
+            if not os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+                raise
+
+    finally:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+
+
+# Manifest of a directory, or None if it doesn't exist
+def read_manifest(directory):
+
+    manifest_file = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_file):
+        return None
+
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+# Memory map of a saved array, read only because every process shares it
+def open_array(directory, name):
+    return np.load(array_file(directory, name), mmap_mode="r")
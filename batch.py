@@ -0,0 +1,138 @@
+import numpy as np  # For the blocks of users x books
+
+import scoring  # For the results of every profile
+
+# Amount of users that are scored at the same time
+# Every block keeps a few arrays of block size x every book in memory, so a smaller block needs less memory
+BLOCK_SIZE = 256
+
+
+# Favourite books of many users at once, like get_favourites
+# Returns the row of the user and the favourite book, for every favourite
+def favourite_books(data, users, amount=3):
+
+    rows, positions = scoring.csr_rows(data.user_offsets, users)
+    books, ratings = data.rating_books[positions], data.rating_values[positions]
+
+    # Highest ratings first, if two books have the same rating the one that was rated first wins
+    order = np.lexsort((positions, -ratings.astype(np.int64), rows))
+    rows, books = rows[order], books[order].astype(np.int64)
+
+    ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+
+    return rows[ranks < amount], books[ranks < amount]
+
+
+# Matches of a block of users with every book, like user_matches but every array is users x books
+# Preferences are sparse: a few (user, author) and (user, keyword) pairs from the favourite books
+# and the inverted index gives the books of every pair, so only the books that match are touched
+def block_matches(data, features, index, users):
+
+    block, book_count = len(users), features.book_count
+    fav_rows, fav_books = favourite_books(data, users)
+
+    # Users x authors
+    author_count = max(len(index.author_offsets) - 1, 1)
+    pairs = np.unique(fav_rows * author_count + features.book_authors[fav_books])
+    pair_rows, authors = np.divmod(pairs, author_count)
+    posting_pairs, positions = scoring.csr_rows(index.author_offsets, authors)
+
+    author = np.zeros(block * book_count, dtype=bool)
+    author[pair_rows[posting_pairs] * book_count + index.author_books[positions]] = True
+
+    # Users x keywords, a keyword may be there twice for the same user, like in get_preferences
+    keyword_rows, keyword_positions = scoring.csr_rows(features.keyword_offsets, fav_books)
+    keyword_rows = fav_rows[keyword_rows]
+    user_keywords = np.bincount(keyword_rows, minlength=block)
+
+    pairs = np.unique(keyword_rows * max(features.keyword_count, 1) + features.keyword_ids[keyword_positions])
+    pair_rows, keyword_ids = np.divmod(pairs, max(features.keyword_count, 1))
+    posting_pairs, positions = scoring.csr_rows(index.keyword_offsets, keyword_ids)
+
+    # Users x keywords times keywords x books, as sums over the inverted lists of every pair
+    cells = pair_rows[posting_pairs] * book_count + index.keyword_books[positions]
+    intersections = np.bincount(cells, weights=index.keyword_repeats[positions], minlength=block * book_count)
+    distinct_intersections = np.bincount(cells, minlength=block * book_count).astype(np.float64)
+
+    # Same as keyword_unions
+    unions = features.keyword_lengths + np.bincount(pair_rows, minlength=block)[:, np.newaxis]
+    unions = unions - distinct_intersections.reshape(block, book_count)
+
+    # Years of every user are only a few, so the proximity of every year is computed user by user
+    years = np.zeros((block, len(features.years)))
+    year_values = features.book_years[fav_books]
+    for row in range(block):
+        years[row] = scoring.years_proximity(features.years, year_values[fav_rows == row])
+
+    return {
+        "author": author.reshape(block, book_count),
+        "intersections": intersections.reshape(block, book_count),
+        "unions": unions,
+        "lengths": features.keyword_lengths,
+        "user_keywords": user_keywords[:, np.newaxis],
+        "year": years[:, features.book_year_ids],
+    }
+
+
+# Scores of the neighbours of the favourites of a block of users, users x books, like NeighbourIndex.scores
+def block_neighbour_scores(data, neighbour_index, users):
+
+    fav_rows, fav_books = favourite_books(data, users)
+    neighbour_rows, positions = scoring.csr_rows(neighbour_index.neighbour_offsets, fav_books)
+    rows = fav_rows[neighbour_rows]
+
+    scores = np.zeros((len(users), neighbour_index.book_count))
+    np.add.at(scores, (rows, neighbour_index.neighbour_books[positions]),
+              neighbour_index.neighbour_similarities[positions].astype(np.float64))
+
+    return scores / np.maximum(np.bincount(fav_rows, minlength=len(users)), 1)[:, np.newaxis]
+
+
+# Top books of a block of users for every profile
+# With neighbour_index, the scores of the neighbours of the favourites are added to every result
+# Returns a dictionary with the name of the profile as key and two arrays of users x amount as value:
+# the ids of the books, the same books as suggest_books, and their results
+def score_block(data, features, index, users, amount=10, profiles=None, neighbour_index=None):
+
+    users = np.asarray(users, dtype=np.int64)
+    results = scoring.profile_results(block_matches(data, features, index, users), profiles)
+
+    if neighbour_index is not None:
+        neighbour_scores = block_neighbour_scores(data, neighbour_index, users)
+        results = {name: result + neighbour_index.weight * neighbour_scores for name, result in results.items()}
+
+    # Books that the users already rated are never suggested
+    rows, positions = scoring.csr_rows(data.user_offsets, users)
+    read = rows * features.book_count + data.rating_books[positions]
+
+    tops = {}
+    for name, result in results.items():
+        result.reshape(-1)[read] = -np.inf
+
+        top = scoring.top_books_of_rows(result, amount)
+        top_results = np.take_along_axis(result, np.maximum(top, 0), axis=1)
+        top_results[top < 0] = -np.inf
+
+        tops[name] = top, top_results
+
+    return tops
+
+
+# Top books of every user for every profile, a block of users at a time
+# Yields the users of the block and the tops of score_block
+def recommend_users(data, features, index, users, amount=10, block_size=BLOCK_SIZE, profiles=None,
+                    neighbour_index=None):
+
+    users = np.asarray(users, dtype=np.int64)
+    block_size = max(block_size, 1)
+
+    for start in range(0, len(users), block_size):
+        block_users = users[start:start + block_size]
+
+        yield block_users, score_block(data, features, index, block_users, amount, profiles, neighbour_index)
+
+
+# Tops of one row of score_block as [[id of the book, result]], like the tops of main.recommend_user
+def row_tops(tops, row, amount=None):
+    return {name: [[book, result] for book, result in zip(top[row].tolist(), results[row].tolist()) if book >= 0][:amount]
+            for name, (top, results) in tops.items()}
@@ -0,0 +1,174 @@
+import argparse  # For the arguments of the command line
+import json  # For the report
+import os  # For the directories of the data
+import platform  # For the machine of the report
+import time  # For the date of the report
+from concurrent.futures import ProcessPoolExecutor  # For a new process for every scale
+
+import numpy as np  # For the random users
+import batch  # For the suggestions of a block of users
+import candidates  # For the inverted index of the books
+import dataset  # For the pruning and the dataset
+import evaluation  # For the overlaps of a block of users
+import instrument  # For the time and the peak memory of every stage
+import keywords  # For the keywords of every title
+import main  # For the stages of the pipeline
+import scoring  # For the features of the books
+import synthetic  # For the data of every scale
+
+# Data of every scale is written here, and the report next to it
+BENCHMARK_DIRECTORY = "benchmarks/"
+
+REPORT_FILE = "report.json"
+
+# Users whose recommendations are timed, the stages of a user don't depend on the scale as much
+SAMPLE_USERS = 100
+
+# A stage is slower than the baseline if it takes this many times the time of the baseline
+TOLERANCE = 1.5
+
+
+# Every stage of the pipeline on the synthetic data of a scale, in the same order as main
+# recommend_user and user_record are the stages of a user in all mode, score_block and evaluate the stages of the
+# sample in batch mode, and baseline_full_scan scores every book for a user, like the pipeline did before the
+# threshold algorithm, so the time of the fast paths can be compared with it
+# It runs in its own process, so the peak memory is the peak of this scale only
+def run_scale(directory, scale, sample=SAMPLE_USERS, seed=0):
+
+    # The stage of every user is the sum of every user of the sample
+    instruments = instrument.Instruments()
+
+    with instruments.stage("generate"):
+        (users_file, books_file, ratings_file), sizes = synthetic.generate(directory, scale, seed)
+
+    with instruments.stage("get_from_csv"):
+        all_users = main.get_from_csv(users_file)
+        all_books = main.get_from_csv(books_file)
+
+    with instruments.stage("pruning"):
+        users, books = dataset.prune_ratings_file(ratings_file, all_users, all_books,
+                                                  os.path.join(directory, "pruned-ratings.csv"))
+
+    with instruments.stage("dataset"):
+        data = dataset.Dataset.from_ratings_file(users, books, os.path.join(directory, "pruned-ratings.csv"))
+
+    with instruments.stage("keywords"):
+        data.set_keywords(*keywords.extract_keywords(data.titles))
+
+    with instruments.stage("features"):
+        features = scoring.BookFeatures.from_dataset(data)
+        index = candidates.InvertedIndex(features)
+
+    # Same users for the same seed
+    sample_users = np.random.default_rng(seed).choice(data.user_count, min(sample, data.user_count), replace=False)
+
+    for user in sample_users.tolist():
+
+        with instruments.stage("recommend_user"):
+            _, preferences, tops = main.recommend_user(data, features, index, user)
+
+        with instruments.stage("user_record"):
+            main.user_record(data, user, tops)
+
+        with instruments.stage("baseline_full_scan"):
+            for result in main.uniformities(features, preferences).values():
+                main.top_results(data, result, user)
+
+    with instruments.stage("score_block", len(sample_users)):
+        tops = batch.score_block(data, features, index, sample_users)
+
+    with instruments.stage("evaluate", len(sample_users)):
+        evaluation.evaluate([data.user_ids[user] for user in sample_users.tolist()], tops)
+
+    return {
+        "scale": scale,
+        "generated": sizes,
+        "pruned": {"users": data.user_count, "books": data.book_count, "ratings": len(data.rating_books)},
+        "sample_users": len(sample_users),
+        "seconds": {name: round(total["wall_s"], 4) for name, total in instruments.totals.items()},
+        "cpu_seconds": {name: round(total["cpu_s"], 4) for name, total in instruments.totals.items()},
+        "peak_memory_mb": round(instrument.peak_rss() / instrument.MEGABYTE, 1),
+    }
+
+
+# Stages of the report that take TOLERANCE times the time of the baseline, for the scales of both reports
+def regressions(report, baseline, tolerance=TOLERANCE):
+
+    old_scales = {result["scale"]: result for result in baseline["scales"]}
+    slower = []
+
+    for result in report["scales"]:
+        old = old_scales.get(result["scale"])
+        if old is None:
+            continue
+
+        for name, seconds in result["seconds"].items():
+            old_seconds = old["seconds"].get(name)
+            if old_seconds and seconds > old_seconds * tolerance:
+                slower.append((result["scale"], name, old_seconds, seconds))
+
+    return slower
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description="Time of every stage of the pipeline on synthetic data")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.05, 0.1, 0.2],
+                        help="sizes of the data, 1 is about the size of Book-Crossing")
+    parser.add_argument("--sample", type=int, default=SAMPLE_USERS, help="users whose recommendations are timed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--directory", default=BENCHMARK_DIRECTORY, help="directory of the data and the report")
+    parser.add_argument("--baseline", help="an older report, stages that are much slower than in it are shown")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="a stage is slower if it takes this many times the time of the baseline")
+
+    return parser.parse_args()
+
+
+def benchmark():
+
+    arguments = parse_arguments()
+
+    report = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "seed": arguments.seed,
+        "scales": [],
+    }
+
+    for scale in arguments.scales:
+        directory = os.path.join(arguments.directory, "scale-%g" % scale)
+
+        # A new process for every scale, so the memory of the previous scale doesn't count
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(run_scale, directory, scale, arguments.sample, arguments.seed).result()
+
+        report["scales"].append(result)
+
+        print("Scale %g: %d ratings, peak memory %.1f MB" % (scale, result["generated"]["ratings"],
+                                                               result["peak_memory_mb"]))
+        for name, seconds in result["seconds"].items():
+            print("    %-24s %9.3f s" % (name, seconds))
+
+    report_file = os.path.join(arguments.directory, REPORT_FILE)
+    with open(report_file, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Report is saved to", report_file)
+
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as f:
+            slower = regressions(report, json.load(f), arguments.tolerance)
+
+        for scale, name, old_seconds, seconds in slower:
+            print("Scale %g: %s takes %.3f s, it took %.3f s" % (scale, name, seconds, old_seconds))
+
+        # A failed run for scripts that check the benchmark
+        if slower:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    benchmark()
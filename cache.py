@@ -0,0 +1,117 @@
+import hashlib  # For the fingerprint of the ratings of a user
+import shelve  # For the cache on disk
+import threading  # For the requests of the server
+from collections import OrderedDict  # For the order of the latest uses
+
+# Most entries that are kept in memory
+CACHE_SIZE = 10000
+
+# Key of the disk cache that keeps its version
+_VERSION_KEY = "__version__"
+
+
+# Fingerprint of the ratings of a user, it changes with any new, removed or changed rating
+def rating_fingerprint(data, user):
+
+    books, ratings = data.user_ratings(user)
+
+    return hashlib.blake2b(books.tobytes() + ratings.tobytes(), digest_size=16).hexdigest()
+
+
+# Least recently used cache of favourites, preferences and tops of users, with an optional second tier on disk
+# Every entry keeps the fingerprint of the ratings it was computed from,
+# so an entry is invalid as soon as the ratings of its user change
+# version is anything else the entries depend on (for example the books file), a new version empties the disk tier
+class RecommendationCache:
+
+    def __init__(self, size=CACHE_SIZE, disk_file=None, version=""):
+
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self.disk = None
+        if disk_file is not None:
+            self.disk = shelve.open(disk_file)
+
+            if self.disk.get(_VERSION_KEY) != version:
+                self.disk.clear()
+                self.disk[_VERSION_KEY] = version
+
+    # Value of a key, or None if it isn't in the cache or its ratings changed
+    def get(self, key, fingerprint):
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None and self.disk is not None:
+                entry = self.disk.get(key)
+                if entry is not None and entry[0] == fingerprint:
+                    self.disk_hits += 1
+                    self._remember(key, entry)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry[0] != fingerprint:
+                self._forget(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def put(self, key, fingerprint, value):
+
+        with self.lock:
+            self._remember(key, (fingerprint, value))
+
+            if self.disk is not None:
+                self.disk[key] = (fingerprint, value)
+
+    # Remove a key, for example when new ratings of its user arrive
+    def invalidate(self, key):
+
+        with self.lock:
+            if self._forget(key):
+                self.invalidations += 1
+
+    def _remember(self, key, entry):
+
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+
+        # Entries that were used the longest time ago leave the memory, they are still on disk
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _forget(self, key):
+
+        found = self.entries.pop(key, None) is not None
+
+        if self.disk is not None and key in self.disk:
+            del self.disk[key]
+            found = True
+
+        return found
+
+    def stats(self):
+
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "disk_hits": self.disk_hits,
+                    "misses": self.misses, "evictions": self.evictions, "invalidations": self.invalidations}
+
+    def close(self):
+
+        if self.disk is not None:
+            self.disk.close()
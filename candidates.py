@@ -0,0 +1,257 @@
+import numpy as np  # For the lists of books
+
+import scoring  # For the proximity of years
+
+
+# Positions grouped by a value: the positions with value v are order[offsets[v]:offsets[v + 1]], sorted
+def _group(values, value_count):
+
+    order = np.argsort(values, kind="stable")
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(values, minlength=value_count))))
+
+    return order, offsets
+
+
+# Books of many groups at once
+def _books_of(grouped_books, offsets, values):
+
+    values = np.asarray(values, dtype=np.int64)
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    _, positions = scoring.csr_rows(offsets, values)
+
+    return grouped_books[positions]
+
+
+# Inverted indexes of the books: author -> books, keyword -> books and year -> books
+# Most books share neither an author nor a keyword with a user, so only a few books need their whole result
+class InvertedIndex:
+
+    def __init__(self, features):
+
+        # Books grouped by a value: the books with value v are books[offsets[v]:offsets[v + 1]], sorted by id
+        self.author_books, self.author_offsets = _group(
+            features.book_authors, int(features.book_authors.max(initial=-1)) + 1)
+
+        order, self.keyword_offsets = _group(features.distinct_keyword_ids, features.keyword_count)
+        self.keyword_books = features.distinct_keyword_books[order]
+
+        # Times the keyword is in every book of its list
+        self.keyword_repeats = features.distinct_keyword_repeats[order]
+
+        # Same lists, but every list starts from the books with the most keywords, for threshold_books
+        # A book with fewer keywords can't be more similar than that, see _keyword_bound
+        lengths = features.keyword_lengths[self.keyword_books]
+        keyword_of_books = np.repeat(np.arange(features.keyword_count), np.diff(self.keyword_offsets))
+        order = np.lexsort((self.keyword_books, -lengths, keyword_of_books))
+        self.longest_keyword_books = self.keyword_books[order]
+        self.longest_keyword_lengths = lengths[order]
+
+        # Most times the same keyword is in the same book (for example "The" and "the")
+        self.max_repeats = int(np.max(np.diff(features.keyword_offsets) - np.diff(features.distinct_keyword_offsets),
+                                      initial=0)) + 1
+
+        # Years are a small domain, so every distinct year is a bucket
+        self.years = features.years
+        self.year_books, self.year_offsets = _group(features.book_year_ids, len(self.years))
+
+    # The books with the closest years to the user, except for the skipped books (True in skipped)
+    # Books with the same proximity are taken from the lowest id, so it's the same order as top_books
+    def closest_years(self, user_years, amount, skipped):
+
+        found = []
+
+        for _, books in self.books_by_year(user_years):
+
+            if amount <= 0:
+                break
+
+            books = books[~skipped[books]][:amount]
+
+            found.append(books)
+            amount -= len(books)
+
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+    # Books from the closest year to the user to the furthest one
+    # Every step is the proximity and the books with this proximity, sorted by id
+    def books_by_year(self, user_years):
+
+        proximity = scoring.years_proximity(self.years, user_years)
+
+        # Buckets with the same proximity are taken together
+        for value in np.unique(proximity)[::-1]:
+            buckets = np.flatnonzero(proximity == value)
+            yield value, np.sort(_books_of(self.year_books, self.year_offsets, buckets))
+
+    @property
+    def book_count(self):
+        return len(self.year_books)
+
+
+# Approximate candidates for very large catalogues, from the buckets of a minhash.MinHashIndex
+# The books with keywords like the keywords of the user, the books of the favourite authors
+# and the books with the closest years from the rest
+# Books with a high result but keywords that the index didn't find are missed, see minhash.measure_recall
+# Returns the books sorted by id and their results for every profile, like threshold_books
+def lsh_books(lsh_index, index, features, preferences, excluded, amount=10, profiles=None):
+
+    user_authors, user_keywords, user_years = preferences
+
+    chosen = np.zeros(index.book_count, dtype=bool)
+    chosen[lsh_index.query(user_keywords)] = True
+    chosen[_books_of(index.author_books, index.author_offsets, user_authors)] = True
+    chosen[excluded] = False
+
+    skipped = chosen.copy()
+    skipped[excluded] = True
+    books = np.union1d(np.flatnonzero(chosen), index.closest_years(user_years, amount, skipped))
+
+    return books, scoring.score_profiles(features, preferences, profiles, books)
+
+
+# Highest keyword similarity that a book with at most length keywords and at most common keywords
+# in common with the user may have
+# The union is at least the amount of distinct keywords of the user, and the similarity is never more than 1
+def _keyword_bound(metric, length, common, user_keywords):
+
+    common = min(length, common)
+    if common == 0:
+        return 0.0
+
+    if metric == "jaccard":
+        return min(1.0, common / len(set(user_keywords)))
+
+    return 2 * common / (common + len(user_keywords))
+
+
+# Books of the year list of threshold_books, a few at a time
+class _YearList:
+
+    def __init__(self, index, user_years):
+
+        self.steps = index.books_by_year(user_years)
+        self.books = np.zeros(0, dtype=np.int64)
+        self.value = None
+        self._next_step()
+
+    def _next_step(self):
+
+        for value, books in self.steps:
+            if len(books) > 0:
+                self.value, self.books = value, books
+                return
+
+        self.value, self.books = None, np.zeros(0, dtype=np.int64)
+
+    # The next amount books, from the closest years
+    def take(self, amount):
+
+        taken = []
+
+        while amount > 0 and self.value is not None:
+            taken.append(self.books[:amount])
+            amount -= len(taken[-1])
+            self.books = self.books[len(taken[-1]):]
+
+            if len(self.books) == 0:
+                self._next_step()
+
+        return np.concatenate(taken) if taken else np.zeros(0, dtype=np.int64)
+
+    # Proximity of the next book, no book that isn't taken yet is closer, None if every book is taken
+    @property
+    def frontier(self):
+        return self.value
+
+
+# Exact top of every profile, like top_books of every book, but most books are never scored
+# Threshold algorithm: books are taken from three sorted lists (books of the favourite authors,
+# books of every keyword of the user from the most keywords and books from the closest years) and scored
+# It stops when the highest result that a book that isn't taken yet may have is lower than the N-th best result
+# Returns the scored books sorted by id and their results for every profile, the index is the position in books
+def threshold_books(index, features, preferences, excluded, amount=10, profiles=None):
+
+    if profiles is None:
+        profiles = scoring.PROFILES
+
+    user_authors, user_keywords, user_years = preferences
+    user_keywords_distinct = np.unique(np.asarray(user_keywords, dtype=np.int64))
+
+    # Excluded books are never scored, as if they were already taken
+    taken = np.zeros(index.book_count, dtype=bool)
+    taken[excluded] = True
+
+    found_books = []
+    found_results = {name: [] for name in profiles}
+
+    # Books of the favourite authors are taken all at once, they are only a few
+    new_books = [_books_of(index.author_books, index.author_offsets, user_authors)]
+
+    keyword_cursors = index.keyword_offsets[user_keywords_distinct]
+    keyword_ends = index.keyword_offsets[user_keywords_distinct + 1]
+    year_list = _YearList(index, user_years)
+
+    step = max(amount, 1)
+
+    while True:
+
+        # Next books of every list
+        for i in range(len(keyword_cursors)):
+            end = min(keyword_cursors[i] + step, keyword_ends[i])
+            new_books.append(index.longest_keyword_books[keyword_cursors[i]:end])
+            keyword_cursors[i] = end
+
+        new_books.append(year_list.take(step))
+
+        books = np.unique(np.concatenate(new_books))
+        books = books[~taken[books]]
+        taken[books] = True
+
+        results = scoring.score_profiles(features, preferences, profiles, books)
+
+        found_books.append(books)
+        for name in profiles:
+            found_results[name].append(results[name])
+
+        new_books = []
+        step *= 2
+
+        # Every book is taken
+        if year_list.frontier is None:
+            break
+
+        # Most keywords of a book that isn't taken yet, and most keywords in common with the user
+        # Such a book is only in the keyword lists that aren't finished yet
+        open_lists = keyword_cursors < keyword_ends
+        longest = int(index.longest_keyword_lengths[keyword_cursors[open_lists]].max()) if open_lists.any() else 0
+        common = int(open_lists.sum()) * index.max_repeats
+
+        if all(_is_complete(np.concatenate(found_results[name]), amount, author_value, keywords_value,
+                            year_value, _keyword_bound(metric, longest, common, user_keywords), year_list.frontier)
+               for name, (metric, author_value, keywords_value, year_value) in profiles.items()):
+            break
+
+    books = np.concatenate(found_books)
+    order = np.argsort(books)
+
+    return books[order], {name: np.concatenate(found_results[name])[order] for name in profiles}
+
+
+# If the N-th best result is higher than the result of any book that isn't taken yet
+# Every book of the favourite authors is already taken, so the rest have 0 from the author
+def _is_complete(results, amount, author_value, keywords_value, year_value, keyword_bound, year_frontier):
+
+    if len(results) < amount:
+        return False
+
+    if amount <= 0:
+        return True
+
+    # Same calculation and order as the results, so they can be compared exactly
+    threshold = 0.0 * author_value
+    threshold += keyword_bound * keywords_value
+    threshold += year_frontier * year_value
+
+    return np.partition(results, len(results) - amount)[len(results) - amount] > threshold
@@ -0,0 +1,481 @@
+import hashlib  # For the content of the source files
+import os  # For file modification times
+
+import numpy as np  # For the typed columns of the cache
+import pandas as pd  # For CSV
+
+# Binary cache of the cleaned users, books and ratings, with integer ids
+# It is saved next to the CSV files and it is used until any of them changes
+CACHE_FILE = "dataset-cache.npz"
+
+# Rows that ingest adds are saved next to the cache, a file for every ingest, until there are this many files
+# and the whole cache is saved again
+MAX_CACHE_APPENDS = 50
+
+# Amount of ratings that are kept in memory at the same time while the ratings file is read
+CHUNK_SIZE = 100000
+
+# Strings of a column are joined with this character and saved as a single array of bytes
+SEPARATOR = "\x00"
+
+
+# Modification time and size of every source file
+# If any of them changes, the cache is not valid anymore
+def source_signature(files):
+
+    signature = []
+
+    for file_name in files:
+        stat = os.stat(file_name)
+        signature.append("%s|%d|%d" % (os.path.abspath(file_name), stat.st_mtime_ns, stat.st_size))
+
+    return signature
+
+
+# Hash of the content of every source file, the same on every machine and for every copy of the files
+def content_signature(files, block_size=1 << 20):
+
+    signature = []
+
+    for file_name in files:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(file_name, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+        signature.append(digest.hexdigest())
+
+    return signature
+
+
+def _is_integer_column(values):
+
+    # Only columns whose values are written exactly like integers, so ISBN like "0425115801" stay strings
+    for value in values:
+        if not isinstance(value, str) or not value.isdigit() or str(int(value)) != value:
+            return False
+
+    return len(values) > 0
+
+
+def _pack_column(values):
+
+    if _is_integer_column(values):
+        column = np.array(values, dtype=np.int64)
+        return "int", column.astype(np.min_scalar_type(column.max()))
+
+    # Missing values of the CSV (NaN) are saved as empty strings, just like write_to_csv does
+    return "str", pack_strings([value if isinstance(value, str) else "" for value in values])
+
+
+def _unpack_column(kind, column, length):
+
+    if length == 0:
+        return []
+
+    if kind == "int":
+        return list(map(str, column.tolist()))
+
+    return unpack_strings(column)
+
+
+# A list of strings as a single array of bytes
+def pack_strings(values):
+    return np.frombuffer(SEPARATOR.join(values).encode("utf-8"), dtype=np.uint8)
+
+
+def unpack_strings(column):
+    return column.tobytes().decode("utf-8").split(SEPARATOR)
+
+
+# Dense integer id for every value, in order of first appearance, and the list of distinct values
+def intern(values):
+
+    ids, vocabulary = pd.factorize(pd.Series(values, dtype=object), sort=False)
+
+    return ids.astype(np.int32), list(vocabulary)
+
+
+# Users, books and ratings with integer ids instead of strings
+# Book i is the i-th ISBN of isbns, user i is the i-th id of user_ids
+# Ratings are three parallel arrays: user id, book id and the rating itself
+# They are grouped by user, so the ratings of user i are the ones between user_offsets[i] and user_offsets[i + 1]
+# Keywords of book i are keyword_ids[keyword_offsets[i]:keyword_offsets[i + 1]]
+class Dataset:
+
+    def __init__(self, user_ids, isbns, titles, authors, book_authors, book_years,
+                 rating_users, rating_books, rating_values):
+
+        self.user_ids = user_ids
+        self.user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+
+        self.isbns = isbns
+        self.isbn_index = {isbn: i for i, isbn in enumerate(isbns)}
+        self.titles = titles
+
+        # Author of every book is an index of authors
+        self.authors = authors
+        self.book_authors = book_authors
+
+        # Invalid years are 0
+        self.book_years = book_years
+
+        # Stable sort, so the ratings of every user stay in the same order as in the ratings file
+        if np.any(np.diff(rating_users) < 0):
+            order = np.argsort(rating_users, kind="stable")
+            rating_users, rating_books, rating_values = rating_users[order], rating_books[order], rating_values[order]
+
+        self.rating_users = rating_users
+        self.rating_books = rating_books
+        self.rating_values = rating_values
+        self.user_offsets = np.concatenate(([0], np.cumsum(np.bincount(rating_users, minlength=len(user_ids)))))
+
+        self.keywords = []
+        self.keyword_offsets = np.zeros(len(isbns) + 1, dtype=np.int64)
+        self.keyword_ids = np.zeros(0, dtype=np.int32)
+
+    # Build it from the lists of rows that get_from_csv returns
+    # Duplicate users and books are ignored, just like ratings of users or books that don't exist
+    @classmethod
+    def from_rows(cls, users, books, ratings):
+
+        user_ids = [user[0] for user in _unique_rows(users)]
+
+        books = _unique_rows(books)
+        isbns = [book[0] for book in books]
+        titles = [book[1] if isinstance(book[1], str) else "" for book in books]
+        book_authors, authors = intern([book[2] if isinstance(book[2], str) else "" for book in books])
+        book_years = pd.to_numeric(pd.Series([book[3] for book in books], dtype=object), errors="coerce")
+        book_years = book_years.fillna(0).clip(0, np.iinfo(np.int16).max).astype(np.int16).values
+
+        return cls(user_ids, isbns, titles, authors, book_authors, book_years,
+                   *_rating_arrays(pd.Index(user_ids), pd.Index(isbns), [rating[0] for rating in ratings],
+                                   [rating[1] for rating in ratings], [rating[2] for rating in ratings]))
+
+    # Same as from_rows with the rows of the ratings file, but the ratings file is read a chunk at a time
+    # Only the arrays of ids are kept, so the rows of every rating are never in memory at the same time
+    @classmethod
+    def from_ratings_file(cls, users, books, ratings_file, chunk_size=CHUNK_SIZE):
+
+        data = cls.from_rows(users, books, [])
+        user_index, isbn_index = pd.Index(data.user_ids), pd.Index(data.isbns)
+
+        chunks = [_rating_arrays(user_index, isbn_index, chunk.iloc[:, 0], chunk.iloc[:, 1], chunk.iloc[:, 2])
+                  for chunk in read_ratings_in_chunks(ratings_file, chunk_size)]
+        if not chunks:
+            return data
+
+        rating_users, rating_books, rating_values = [np.concatenate(arrays) for arrays in zip(*chunks)]
+
+        return cls(data.user_ids, data.isbns, data.titles, data.authors, data.book_authors, data.book_years,
+                   rating_users, rating_books, rating_values)
+
+    # Keywords of every book, like extract_keywords returns them
+    def set_keywords(self, keyword_offsets, keyword_ids, keywords):
+
+        self.keyword_offsets = keyword_offsets
+        self.keyword_ids = keyword_ids
+        self.keywords = keywords
+
+    # Books and ratings of a user
+    def user_ratings(self, user):
+
+        start, end = self.user_offsets[user], self.user_offsets[user + 1]
+
+        return self.rating_books[start:end], self.rating_values[start:end]
+
+    def book_keywords(self, book):
+        return self.keyword_ids[self.keyword_offsets[book]:self.keyword_offsets[book + 1]]
+
+    # ISBN, title, author and year of a book, like a row of the books file
+    def book_record(self, book):
+        return [self.isbns[book], self.titles[book], self.authors[self.book_authors[book]], str(self.book_years[book])]
+
+    @property
+    def user_count(self):
+        return len(self.user_ids)
+
+    @property
+    def book_count(self):
+        return len(self.isbns)
+
+
+# Ids of the users and books of ratings and their values, without the ratings of users or books that don't exist
+def _rating_arrays(user_index, isbn_index, users, isbns, values):
+
+    rating_users = user_index.get_indexer(users)
+    rating_books = isbn_index.get_indexer(isbns)
+    rating_values = pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").fillna(0).values
+
+    exists = (rating_users >= 0) & (rating_books >= 0)
+
+    return (rating_users[exists].astype(np.int32), rating_books[exists].astype(np.int32),
+            rating_values[exists].astype(np.int8))
+
+
+# Dataset with more users, books and ratings, the same as from_rows of the old rows followed by the new ones
+# Users and books that already exist are ignored, new ones get the next ids so the old ids don't change
+# Keywords are not copied, the books changed
+def append_rows(data, users, books, ratings):
+
+    new = Dataset.from_rows([user for user in users if user[0] not in data.user_index],
+                            [book for book in books if book[0] not in data.isbn_index], [])
+
+    user_ids = data.user_ids + new.user_ids
+    isbns = data.isbns + new.isbns
+
+    # Authors of the new books, old authors keep their ids
+    old_authors = set(data.authors)
+    authors = data.authors + [author for author in new.authors if author not in old_authors]
+    new_book_authors = pd.Index(authors).get_indexer(new.authors)[new.book_authors]
+
+    rating_users = pd.Index(user_ids).get_indexer([rating[0] for rating in ratings])
+    rating_books = pd.Index(isbns).get_indexer([rating[1] for rating in ratings])
+    rating_values = pd.to_numeric(pd.Series([rating[2] for rating in ratings], dtype=object), errors="coerce")
+    rating_values = rating_values.fillna(0).values.astype(np.int8)
+
+    exists = (rating_users >= 0) & (rating_books >= 0)
+
+    return Dataset(user_ids, isbns, data.titles + new.titles, authors,
+                   np.concatenate((data.book_authors, new_book_authors)).astype(data.book_authors.dtype),
+                   np.concatenate((data.book_years, new.book_years)),
+                   np.concatenate((data.rating_users, rating_users[exists])).astype(np.int32),
+                   np.concatenate((data.rating_books, rating_books[exists])).astype(np.int32),
+                   np.concatenate((data.rating_values, rating_values[exists])))
+
+
+# File of the rows that the part-th ingest after the last save_cache added, the first is 1
+def _append_file(cache_file, part):
+    return "%s.append-%d.npz" % (cache_file, part)
+
+
+def _append_files(cache_file):
+
+    part = 1
+    while os.path.exists(_append_file(cache_file, part)):
+        yield _append_file(cache_file, part)
+        part += 1
+
+
+# Rows of the CSV files as packed columns, only the columns that from_rows reads
+def _pack_rows(name, rows, columns):
+
+    arrays = {name + "_length": np.array(len(rows))}
+    for column in range(columns):
+        arrays["%s_%d" % (name, column)] = pack_strings(
+            [row[column] if isinstance(row[column], str) else "" for row in rows])
+
+    return arrays
+
+
+def _unpack_rows(arrays, name, columns):
+
+    length = int(arrays[name + "_length"])
+    if length == 0:
+        return []
+
+    return [list(row) for row in zip(*[unpack_strings(arrays["%s_%d" % (name, column)]) for column in range(columns)])]
+
+
+# Save a dataset to the binary cache
+def save_cache(cache_file, sources, data):
+
+    arrays = {"sources": pack_strings(source_signature(sources))}
+
+    for name in ["user_ids", "isbns", "titles", "authors"]:
+        kind, column = _pack_column(getattr(data, name))
+        arrays[name + "_" + kind] = column
+        arrays[name + "_length"] = np.array(len(getattr(data, name)))
+
+    for name in ["book_authors", "book_years", "rating_users", "rating_books", "rating_values"]:
+        arrays[name] = getattr(data, name)
+
+    # Write to a temporary file first, so a half written cache is never used
+    temp_file = cache_file + ".tmp"
+    with open(temp_file, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(temp_file, cache_file)
+
+    # Rows of older ingests are in the cache now
+    for file_name in list(_append_files(cache_file)):
+        os.remove(file_name)
+
+
+# Save only the rows that an ingest added to the dataset (see append_rows), next to the cache
+# old_signature is the signature of the source files before the rows were appended to them,
+# the rows are only used if the cache was valid for these files
+# After MAX_CACHE_APPENDS ingests the whole dataset is saved again
+def append_cache(cache_file, old_signature, sources, data, users, books, ratings):
+
+    part = len(list(_append_files(cache_file))) + 1
+    if part > MAX_CACHE_APPENDS or not os.path.exists(cache_file):
+        save_cache(cache_file, sources, data)
+        return
+
+    arrays = {"old_sources": pack_strings(old_signature), "sources": pack_strings(source_signature(sources))}
+    arrays.update(_pack_rows("users", users, 1))
+    arrays.update(_pack_rows("books", books, 4))
+    arrays.update(_pack_rows("ratings", ratings, 3))
+
+    file_name = _append_file(cache_file, part)
+    with open(file_name + ".tmp", "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(file_name + ".tmp", file_name)
+
+
+# Load a dataset from the binary cache, with the rows of every ingest after it was saved
+# Returns None if there is no cache or if any of the source files changed after it was saved
+def load_cache(cache_file, sources):
+
+    if not os.path.exists(cache_file):
+        return None
+
+    with np.load(cache_file) as npz:
+        arrays = {key: npz[key] for key in npz.files}
+
+    # Every ingest starts from the files that the one before it left
+    signature = unpack_strings(arrays["sources"])
+    appends = []
+    for file_name in _append_files(cache_file):
+        with np.load(file_name) as npz:
+            appended = {key: npz[key] for key in npz.files}
+
+        if unpack_strings(appended["old_sources"]) != signature:
+            return None
+
+        signature = unpack_strings(appended["sources"])
+        appends.append(appended)
+
+    if signature != source_signature(sources):
+        return None
+
+    columns = {}
+    for name in ["user_ids", "isbns", "titles", "authors"]:
+        kind = "int" if name + "_int" in arrays else "str"
+        columns[name] = _unpack_column(kind, arrays[name + "_" + kind], int(arrays[name + "_length"]))
+
+    data = Dataset(columns["user_ids"], columns["isbns"], columns["titles"], columns["authors"],
+                   arrays["book_authors"], arrays["book_years"],
+                   arrays["rating_users"], arrays["rating_books"], arrays["rating_values"])
+
+    for appended in appends:
+        data = append_rows(data, _unpack_rows(appended, "users", 1), _unpack_rows(appended, "books", 4),
+                           _unpack_rows(appended, "ratings", 3))
+
+    return data
+
+
+# Read the ratings file a few rows at a time, with the same settings as get_from_csv
+def read_ratings_in_chunks(file_name, chunk_size=CHUNK_SIZE):
+    return pd.read_csv(file_name, delimiter=';', encoding="ISO-8859-1", error_bad_lines=False, dtype='unicode',
+                       chunksize=chunk_size)
+
+
+# Count the ratings of every user and book, only for ratings whose user and book are still kept
+# None means that nothing is removed yet
+def _count_ratings(file_name, kept_users, kept_books, chunk_size):
+
+    user_counts = pd.Series(dtype="int64")
+    isbn_counts = pd.Series(dtype="int64")
+
+    for chunk in read_ratings_in_chunks(file_name, chunk_size):
+        chunk = _keep_ratings(chunk, kept_users, kept_books)
+
+        user_counts = user_counts.add(chunk.iloc[:, 0].value_counts(), fill_value=0)
+        isbn_counts = isbn_counts.add(chunk.iloc[:, 1].value_counts(), fill_value=0)
+
+    return user_counts, isbn_counts
+
+
+def _keep_ratings(chunk, kept_users, kept_books):
+
+    if kept_users is None:
+        return chunk
+
+    return chunk[chunk.iloc[:, 0].isin(kept_users) & chunk.iloc[:, 1].isin(kept_books)]
+
+
+# Remove books, users and ratings until every book has at least 10 ratings and every user at least 5
+# When ratings are removed, some users or books may fall below their limit, so it repeats until nothing changes
+# The ratings file is never fully loaded into memory
+# Every pass reads the file once and counts the ratings of the users and books that survived the previous pass
+# When nothing changes, the surviving ratings are written to output_file and the surviving users and books are returned
+# Every pass prints how many books, users and ratings it removed
+# If pending_file is given, the rest of the ratings are written there, so they may be added later (see ingest)
+def prune_ratings_file(ratings_file, users, books, output_file, chunk_size=CHUNK_SIZE,
+                       min_book_ratings=10, min_user_ratings=5, pending_file=None):
+
+    kept_users = pd.Index([user[0] for user in users]).unique()
+    kept_books = pd.Index([book[0] for book in books]).unique()
+    counted = None
+    passes = 0
+
+    while True:
+        user_counts, isbn_counts = _count_ratings(ratings_file, None if passes == 0 else kept_users,
+                                                  None if passes == 0 else kept_books, chunk_size)
+
+        # Ratings that the last pass removed are known only when the ratings that are left are counted
+        if passes > 0:
+            print("Pass %d: removed %d books, %d users and %d ratings" % (
+                passes, removed_books, removed_users, counted - int(user_counts.sum())))
+
+        passes += 1
+        counted = int(user_counts.sum())
+
+        new_users = kept_users.intersection(user_counts.index[user_counts >= min_user_ratings])
+        new_books = kept_books.intersection(isbn_counts.index[isbn_counts >= min_book_ratings])
+
+        removed_users, removed_books = len(kept_users) - len(new_users), len(kept_books) - len(new_books)
+        kept_users, kept_books = new_users, new_books
+
+        if passes > 1 and removed_users == 0 and removed_books == 0:
+            print("Pass %d: removed 0 books, 0 users and 0 ratings" % passes)
+            break
+
+    print("%d books, %d users and %d ratings are left" % (len(kept_books), len(kept_users), counted))
+
+    # Write to a temporary file first, because output_file may be the same file as ratings_file
+    temp_file = output_file + ".tmp"
+    pending = open(pending_file, "w", encoding="ISO-8859-1", newline="") if pending_file is not None else None
+
+    with open(temp_file, "w", encoding="ISO-8859-1", newline="") as f:
+        header = True
+
+        for chunk in read_ratings_in_chunks(ratings_file, chunk_size):
+            kept = _keep_ratings(chunk, kept_users, kept_books)
+
+            # Same header as write_to_csv
+            kept.columns = range(len(kept.columns))
+            kept.to_csv(f, header=header, index=False, sep=';')
+
+            if pending is not None:
+                removed = chunk.drop(kept.index)
+                removed.columns = range(len(removed.columns))
+                removed.to_csv(pending, header=header, index=False, sep=';')
+
+            header = False
+
+    if pending is not None:
+        pending.close()
+
+    os.replace(temp_file, output_file)
+
+    return _keep_rows(users, set(kept_users)), _keep_rows(books, set(kept_books))
+
+
+# Rows whose id is kept, in the same order and without duplicates
+def _keep_rows(rows, kept_ids):
+    return _unique_rows(row for row in rows if row[0] in kept_ids)
+
+
+# Only the first row of every id
+def _unique_rows(rows):
+
+    new_rows = []
+    seen = set()
+
+    for row in rows:
+        if row[0] not in seen:
+            seen.add(row[0])
+            new_rows.append(row)
+
+    return new_rows
@@ -0,0 +1,106 @@
+import numpy as np  # For the tops of every user at once
+import pandas as pd  # For the tables
+
+# Overlaps that are measured: name, the first list and the second list
+# Like main.overlap_fraction, it is the fraction of the books of the second list that are in the first one
+OVERLAPS = [("jaccard_dice", "jaccard", "dice"), ("golden_jaccard", "jaccard", "golden"),
+            ("golden_dice", "dice", "golden")]
+
+
+# Golden standard of every user at once, the same lists as main.get_golden
+# Arguments are users x N arrays of the tops of Jaccard and Dice, books are padded with -1
+# For every book of Jaccard, in order:
+# if it is in the Dice books that are left, its result is the average of both results (times 2)
+# if it isn't, the first Dice book that is left is added with its result and taken out of the Dice list (times 1),
+# and the Jaccard book gets half its result (times 1)
+# Then books with times 2 come first, every times from the highest result to the lowest
+# Returns books, times and results, users x 2N arrays padded with -1, 0 and -inf
+def golden_standard(jaccard_books, jaccard_results, dice_books, dice_results):
+
+    users, amount = jaccard_books.shape
+    rows = np.arange(users)
+    dice_lengths = (dice_books >= 0).sum(axis=1)
+
+    # Position of every Jaccard book in the Dice list, if it is there
+    matches = (jaccard_books[:, :, None] == dice_books[:, None, :]) & (jaccard_books[:, :, None] >= 0)
+    in_dice = matches.any(axis=2)
+    positions = matches.argmax(axis=2)
+
+    books = np.full((users, 2 * amount), -1, dtype=np.int64)
+    times = np.zeros((users, 2 * amount), dtype=np.int64)
+    results = np.full((users, 2 * amount), -np.inf)
+
+    # Dice books before this position were taken out by earlier Jaccard books
+    taken = np.zeros(users, dtype=np.int64)
+
+    # Every position depends on the Dice books that the earlier positions took, but every user is done at once
+    for position in range(amount):
+        valid = jaccard_books[:, position] >= 0
+        both = in_dice[:, position] & (positions[:, position] >= taken)
+        take = valid & ~both & (taken < dice_lengths)
+
+        # The Dice book that is taken comes before the Jaccard book
+        first = np.minimum(taken, dice_books.shape[1] - 1)
+        books[take, 2 * position] = dice_books[rows, first][take]
+        times[take, 2 * position] = 1
+        results[take, 2 * position] = dice_results[rows, first][take]
+        taken += take
+
+        dice_result = np.where(both, dice_results[rows, positions[:, position]], 0.0)
+        books[valid, 2 * position + 1] = jaccard_books[valid, position]
+        times[valid, 2 * position + 1] = np.where(both, 2, 1)[valid]
+        results[valid, 2 * position + 1] = ((dice_result + jaccard_results[:, position]) / 2)[valid]
+
+    # Times and results from the highest to the lowest, the order of the list for equal ones
+    order = np.lexsort((np.broadcast_to(np.arange(2 * amount), books.shape), -results, -times), axis=1)
+
+    return (np.take_along_axis(books, order, axis=1), np.take_along_axis(times, order, axis=1),
+            np.take_along_axis(results, order, axis=1))
+
+
+# Overlap of two lists for every cutoff k from 1 to amount, users x amount
+# Like main.overlap_fraction with amount k: if a list is shorter than k, only as many books as the shortest list are
+# compared, and it is 0 if a list is empty
+# Books are padded with -1 at the end of every row
+def overlaps_at(first_books, second_books, amount):
+
+    # Matches of every book of the second list with every book of the first list, summed over both prefixes
+    matches = (first_books[:, :, None] == second_books[:, None, :]) & (second_books[:, None, :] >= 0)
+    counts = matches.cumsum(axis=1, dtype=np.int16).cumsum(axis=2, dtype=np.int16)
+
+    lengths = np.minimum((first_books >= 0).sum(axis=1), (second_books >= 0).sum(axis=1))
+    compared = np.minimum(np.arange(1, amount + 1)[None, :], lengths[:, None])
+    last = np.maximum(compared - 1, 0)
+
+    found = counts[np.arange(len(first_books))[:, None], last, last]
+
+    return np.where(compared > 0, found / np.maximum(compared, 1), 0.0)
+
+
+# Overlaps of every cutoff, the size of the golden standard and its books with times 2 for every user
+# tops is the dictionary of batch.score_block: for jaccard and dice, the books and results of users x N
+# Returns the table, with a row for every user and columns like golden_dice@10, and the golden standard
+def evaluate(user_ids, tops):
+
+    jaccard_books, jaccard_results = tops["jaccard"]
+    dice_books, dice_results = tops["dice"]
+    amount = jaccard_books.shape[1]
+
+    golden = golden_standard(jaccard_books, jaccard_results, dice_books, dice_results)
+    books = {"jaccard": jaccard_books, "dice": dice_books, "golden": golden[0]}
+
+    columns = {}
+    for name, first, second in OVERLAPS:
+        values = overlaps_at(books[first], books[second], amount)
+        for k in range(amount):
+            columns["%s@%d" % (name, k + 1)] = values[:, k]
+
+    columns["golden_size"] = (golden[1] > 0).sum(axis=1)
+    columns["golden_both"] = (golden[1] == 2).sum(axis=1)
+
+    return pd.DataFrame(columns, index=pd.Index(user_ids, name="user")), golden
+
+
+# Mean, standard deviation, quartiles and extremes of every column over every user
+def summarize(table):
+    return table.describe().T
@@ -0,0 +1,79 @@
+import numpy as np  # For the arrays of the objects
+
+import arraystore  # For the arrays on disk
+import candidates  # For the inverted index of the books
+import dataset  # For the signature of the source files
+import scoring  # For the features of the books
+
+# Features of the books on disk, next to the CSV files
+# Every array is a .npy file, so every run and every worker opens them with a memory map
+# and they all share the same copy from the page cache instead of building their own
+STORE_DIRECTORY = "feature-store/"
+
+# Objects whose arrays are saved, with the name that their files start with
+OBJECTS = {"features": scoring.BookFeatures, "index": candidates.InvertedIndex}
+
+
+# Features and inverted index of every book from the store
+class FeatureStore:
+
+    def __init__(self, features, index):
+
+        self.features = features
+        self.index = index
+
+
+# Write the features and the inverted index of the books to the store
+# Only the arrays and the small values of the objects are saved, they are everything that they need
+def save_store(directory, sources, features, index):
+
+    arrays = {}
+    manifest = {"sources": dataset.source_signature(sources), "arrays": {}, "values": {}}
+
+    for name, obj in [("features", features), ("index", index)]:
+        manifest["arrays"][name], manifest["values"][name] = [], {}
+
+        for attribute, value in vars(obj).items():
+            if isinstance(value, np.ndarray):
+                arrays["%s.%s" % (name, attribute)] = value
+                manifest["arrays"][name].append(attribute)
+
+            elif isinstance(value, (int, float, str)) or value is None:
+                manifest["values"][name][attribute] = value
+
+    arraystore.save_arrays(directory, arrays, manifest)
+
+
+# Open the store with memory maps, nothing is read until it is used
+# Returns None if there is no store or if any of the source files changed after it was saved
+def open_store(directory, sources):
+
+    manifest = arraystore.read_manifest(directory)
+    if manifest is None or manifest["sources"] != dataset.source_signature(sources):
+        return None
+
+    objects = {}
+    for name, cls in OBJECTS.items():
+
+        # Same object as the saved one, without computing anything again
+        obj = cls.__new__(cls)
+        obj.__dict__.update(manifest["values"][name])
+        for attribute in manifest["arrays"][name]:
+            setattr(obj, attribute, arraystore.open_array(directory, "%s.%s" % (name, attribute)))
+
+        objects[name] = obj
+
+    return FeatureStore(objects["features"], objects["index"])
+
+
+# Store of the books of a dataset, it is built and saved only if it is missing or old
+def load_store(directory, sources, data):
+
+    store = open_store(directory, sources)
+    if store is not None:
+        return store
+
+    features = scoring.BookFeatures.from_dataset(data)
+    save_store(directory, sources, features, candidates.InvertedIndex(features))
+
+    return open_store(directory, sources)
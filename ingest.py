@@ -0,0 +1,230 @@
+import json  # For the rows of the pending users and books
+import os  # For the pending files
+import sqlite3  # For the pending ratings, indexed by user and by ISBN
+
+import pandas as pd  # For CSV
+
+import dataset  # For the new rows of the dataset and its cache
+import featurestore  # For the features of the new books
+import keywords  # For the keywords of the new titles
+
+# Users, books and ratings that didn't pass the limits yet
+# start adds them, every delta file adds its ratings and they may pass the limits later
+PENDING_DIRECTORY = "pending/"
+
+PENDING_FILE = "pending.db"
+
+
+def read_rows(file_name):
+
+    if not os.path.exists(file_name):
+        return []
+
+    df = pd.read_csv(file_name, delimiter=';', encoding="ISO-8859-1", error_bad_lines=False, dtype='unicode')
+
+    return [list(x) for x in df.values]
+
+
+# Rows at the end of a CSV file that write_to_csv saved, without reading it
+def append_to_csv(file_name, rows):
+    pd.DataFrame(rows).to_csv(file_name, mode="a", header=False, index=False, sep=';', encoding='ISO-8859-1')
+
+
+# Pending users, books and ratings in a SQLite file
+# Rows of users and books are kept whole, so they are appended to the CSV files just like they were read
+# Ratings are indexed by user and by ISBN, so an ingest only reads the ratings that are connected to its delta
+class PendingStore:
+
+    def __init__(self, file_name):
+
+        self.connection = sqlite3.connect(file_name)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, row TEXT);
+            CREATE TABLE IF NOT EXISTS books (isbn TEXT PRIMARY KEY, row TEXT);
+            CREATE TABLE IF NOT EXISTS ratings (user TEXT, isbn TEXT, rating TEXT, UNIQUE (user, isbn, rating));
+            CREATE INDEX IF NOT EXISTS ratings_isbn ON ratings (isbn);
+            CREATE TEMP TABLE found_users (id TEXT PRIMARY KEY, step INTEGER);
+            CREATE TEMP TABLE found_books (isbn TEXT PRIMARY KEY, step INTEGER);
+        """)
+
+    # Rows that are already pending are skipped
+    def add_users(self, rows):
+        self.connection.executemany("INSERT OR IGNORE INTO users VALUES (?, ?)",
+                                    ((row[0], json.dumps(list(row))) for row in rows))
+
+    def add_books(self, rows):
+        self.connection.executemany("INSERT OR IGNORE INTO books VALUES (?, ?)",
+                                    ((row[0], json.dumps(list(row))) for row in rows))
+
+    def add_ratings(self, rows):
+        self.connection.executemany("INSERT OR IGNORE INTO ratings VALUES (?, ?, ?)",
+                                    ((row[0], row[1], _text(row[2])) for row in rows))
+
+    # Users and books that are in the dataset now, with the rows that they had, in the order they were added
+    def remove_users(self, ids):
+        return self._remove("users", "id", ids)
+
+    def remove_books(self, isbns):
+        return self._remove("books", "isbn", isbns)
+
+    def _remove(self, table, column, ids):
+
+        rows = []
+        for value in ids:
+            rows.extend(self.connection.execute("SELECT rowid, row FROM %s WHERE %s = ?" % (table, column), (value,)))
+
+        self.connection.executemany("DELETE FROM %s WHERE %s = ?" % (table, column), ((value,) for value in ids))
+
+        return [json.loads(row) for _, row in sorted(rows)]
+
+    def remove_ratings(self, rowids):
+        self.connection.executemany("DELETE FROM ratings WHERE rowid = ?", ((int(rowid),) for rowid in rowids))
+
+    # Pending users and books that are connected to users and books through pending ratings,
+    # and every pending rating of them as (rowid, user, ISBN, rating)
+    # Users and books with fewer pending ratings than their limit can't pass it, so nothing is connected through them:
+    # start and every ingest leave no group of pending users and books that passes the limits,
+    # so whatever passes now is connected to the new ratings through users and books that pass
+    def connected(self, users, books, min_book_ratings=10, min_user_ratings=5):
+
+        connection = self.connection
+        connection.execute("DELETE FROM found_users")
+        connection.execute("DELETE FROM found_books")
+
+        find_users = ("INSERT OR IGNORE INTO found_users SELECT id, ? FROM users WHERE id = ? "
+                      "AND (SELECT COUNT(*) FROM ratings WHERE ratings.user = users.id) >= ?")
+        find_books = ("INSERT OR IGNORE INTO found_books SELECT isbn, ? FROM books WHERE isbn = ? "
+                      "AND (SELECT COUNT(*) FROM ratings WHERE ratings.isbn = books.isbn) >= ?")
+
+        connection.executemany(find_users, ((0, user, min_user_ratings) for user in users))
+        connection.executemany(find_books, ((0, book, min_book_ratings) for book in books))
+
+        # Every round looks only at the users and books that the round before found
+        step = 0
+        while True:
+            step += 1
+            changes = connection.total_changes
+
+            connection.executemany(find_users, ((step, user, min_user_ratings) for user, in connection.execute(
+                "SELECT DISTINCT user FROM ratings WHERE isbn IN (SELECT isbn FROM found_books WHERE step = ?)",
+                (step - 1,)).fetchall()))
+            connection.executemany(find_books, ((step, book, min_book_ratings) for book, in connection.execute(
+                "SELECT DISTINCT isbn FROM ratings WHERE user IN (SELECT id FROM found_users WHERE step >= ?)",
+                (step - 1,)).fetchall()))
+
+            if connection.total_changes == changes:
+                break
+
+        ratings = connection.execute(
+            "SELECT rowid, user, isbn, rating FROM ratings WHERE user IN (SELECT id FROM found_users) "
+            "UNION SELECT rowid, user, isbn, rating FROM ratings WHERE isbn IN (SELECT isbn FROM found_books)").fetchall()
+
+        return ([row[0] for row in connection.execute("SELECT id FROM found_users")],
+                [row[0] for row in connection.execute("SELECT isbn FROM found_books")], ratings)
+
+    def rating_count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM ratings").fetchone()[0]
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+# Missing values of the CSV (NaN) are saved as NULL
+def _text(value):
+    return value if isinstance(value, str) else None
+
+
+# Ratings that can be added to the dataset, and the users and books that pass the limits because of them
+# ratings are the new ratings and the pending ratings that are connected to them, users and books are the pending
+# users and books that they touch (see PendingStore.connected)
+# Users and books of the dataset always pass, new ratings only add to their ratings
+# The rest are removed until every limit holds, like dataset.prune_ratings_file does
+# Returns the users, books and a True for every rating that can be added
+def admit_ratings(data, ratings, users, books, min_book_ratings=10, min_user_ratings=5):
+
+    ratings = pd.DataFrame(ratings, columns=range(3), dtype=object)
+    users, books = set(users), set(books)
+
+    old_user = ratings[0].isin(data.user_ids).values
+    old_book = ratings[1].isin(data.isbns).values
+
+    while True:
+        alive = (old_user | ratings[0].isin(users).values) & (old_book | ratings[1].isin(books).values)
+
+        user_counts = ratings[0][alive & ~old_user].value_counts()
+        book_counts = ratings[1][alive & ~old_book].value_counts()
+
+        new_users = set(user_counts.index[user_counts >= min_user_ratings]) & users
+        new_books = set(book_counts.index[book_counts >= min_book_ratings]) & books
+
+        if len(new_users) == len(users) and len(new_books) == len(books):
+            return users, books, alive
+
+        users, books = new_users, new_books
+
+
+# Add the ratings of a delta file (same format as the ratings file) to the CSV files, the caches and the feature store
+# Nothing is pruned again: only the pending ratings that are connected to the new ones are read, the new rows are
+# appended to the CSV files and to the cache of the dataset, and only the new titles are split into keywords
+# Returns the new dataset, with keywords, and the ids of the users whose ratings changed
+def ingest_file(directory, files, delta_file, data, min_book_ratings=10, min_user_ratings=5):
+
+    users_file, books_file, ratings_file = files
+
+    if not os.path.exists(directory + PENDING_DIRECTORY + PENDING_FILE):
+        print("There are no pending users and books, run start first to add new users and books too")
+        os.makedirs(directory + PENDING_DIRECTORY, exist_ok=True)
+
+    store = PendingStore(directory + PENDING_DIRECTORY + PENDING_FILE)
+    delta = [rating[:3] for rating in read_rows(delta_file)]
+
+    # Ratings of users and books of the dataset are added at once, the rest wait with the pending ratings
+    waiting = [rating for rating in delta if rating[0] not in data.user_index or rating[1] not in data.isbn_index]
+    store.add_ratings(waiting)
+
+    users, books, ratings = store.connected(set(rating[0] for rating in waiting),
+                                            set(rating[1] for rating in waiting), min_book_ratings, min_user_ratings)
+    users, books, alive = admit_ratings(data, [rating[1:] for rating in ratings], users, books,
+                                        min_book_ratings, min_user_ratings)
+
+    new_ratings = [rating for rating in delta if rating[0] in data.user_index and rating[1] in data.isbn_index]
+    new_ratings += [list(rating[1:]) for rating, admitted in zip(ratings, alive) if admitted]
+
+    store.remove_ratings([rating[0] for rating, admitted in zip(ratings, alive) if admitted])
+    new_users = store.remove_users(users)
+    new_books = store.remove_books(books)
+
+    print("%d new ratings: %d ratings, %d users and %d books are added, %d ratings are pending" % (
+        len(delta), len(new_ratings), len(new_users), len(new_books), store.rating_count()))
+
+    # Only the new rows are written to the CSV files
+    signature = dataset.source_signature(files)
+    if new_users:
+        append_to_csv(users_file, new_users)
+    if new_books:
+        append_to_csv(books_file, new_books)
+    if new_ratings:
+        append_to_csv(ratings_file, new_ratings)
+
+    # They are removed from the pending store only when they are in the CSV files
+    store.close()
+
+    keyword_offsets, keyword_ids, vocabulary = data.keyword_offsets, data.keyword_ids, data.keywords
+
+    data = dataset.append_rows(data, new_users, new_books, new_ratings)
+    data.set_keywords(*keywords.extend_keywords(keyword_offsets, keyword_ids, vocabulary,
+                                                data.titles[len(keyword_offsets) - 1:]))
+
+    # Only the new rows are added to the cache of the dataset
+    if new_users or new_books or new_ratings:
+        dataset.append_cache(directory + dataset.CACHE_FILE, signature, files, data, new_users, new_books,
+                             new_ratings)
+
+    # Keywords and features change only with new books
+    if new_books:
+        keywords.save_keywords(directory + keywords.CACHE_FILE, books_file,
+                               data.keyword_offsets, data.keyword_ids, data.keywords)
+        featurestore.load_store(directory + featurestore.STORE_DIRECTORY, [books_file], data)
+
+    return data, sorted(set(rating[0] for rating in new_ratings))
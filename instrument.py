@@ -0,0 +1,203 @@
+import cProfile  # For the profile of a stage
+import json  # For a JSON line for every stage
+import os  # For the memory of the process and the directory of the profiles
+import pstats  # For the text of the profile
+import resource  # For the peak memory of the process
+import sys  # For the unit of the peak memory
+import time  # For the wall and CPU time of every stage
+import tracemalloc  # For the memory that a stage allocates
+from contextlib import contextmanager  # For the stages
+
+# Profiles of --profile are saved here
+PROFILE_DIRECTORY = "profiles/"
+
+# Lines of the profile and of the memory allocations that are saved as text
+PROFILE_LINES = 30
+
+MEGABYTE = 1024 * 1024
+
+# Value of next() at the end of a generator
+_END = object()
+
+
+# Highest resident memory of the process so far in bytes
+# ru_maxrss is in bytes on macOS and in kilobytes on Linux and the other systems
+def peak_rss():
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Resident memory of the process in bytes
+# Where /proc doesn't exist (macOS), it is the peak of the process instead, so its deltas only show new peaks
+def current_rss():
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+# Wall and CPU time, items, throughput and memory of every stage of the pipeline
+# Every call of a stage is a JSON line of log_file if it is given, and summary() sums the calls of every stage
+# The stage that is named profile runs under cProfile and tracemalloc, and close() saves what they found
+# CPU time is the time of this process only, the time of the worker processes isn't in it
+class Instruments:
+
+    def __init__(self, log_file=None, profile=None, profile_directory=PROFILE_DIRECTORY):
+
+        self.log = open(log_file, "a", encoding="utf-8") if log_file is not None else None
+        self.profile = profile
+        self.profile_directory = profile_directory
+        self.profiler = None
+        self.snapshot = None
+        self.peak = 0
+        self.totals = {}
+
+    # with instruments.stage("name", items) as measure: ...
+    # Items may also be set after the stage started, with measure["items"] = amount
+    @contextmanager
+    def stage(self, name, items=None):
+
+        measure = {"items": items}
+        started = self._start(name)
+
+        try:
+            yield measure
+        finally:
+            self._finish(started, measure["items"])
+
+    # Every value of a generator that does its work in next(), like main.recommend_users
+    # Every next() is a call of the stage, items(value) is the amount of items of a value
+    def iterate(self, name, values, items=None):
+
+        values = iter(values)
+
+        while True:
+            started = self._start(name)
+            value = next(values, _END)
+
+            if value is _END:
+                self._finish(started, None, record=False)
+                return
+
+            self._finish(started, items(value) if items is not None else None)
+
+            yield value
+
+    def _start(self, name):
+
+        if name == self.profile:
+            self._start_profile()
+
+        return name, current_rss(), time.process_time(), time.perf_counter()
+
+    def _finish(self, started, items, record=True):
+
+        name, rss, cpu, start = started
+
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+        rss_delta = current_rss() - rss
+
+        if name == self.profile:
+            self._stop_profile()
+
+        if record:
+            self._record(name, wall, cpu, items, rss_delta)
+
+    def _start_profile(self):
+
+        if self.profiler is None:
+            self.profiler = cProfile.Profile()
+
+        tracemalloc.start()
+        self.profiler.enable()
+
+    # Every call adds to the same profile, the memory is the one of the call with the highest peak
+    def _stop_profile(self):
+
+        self.profiler.disable()
+
+        peak = tracemalloc.get_traced_memory()[1]
+        if self.snapshot is None or peak > self.peak:
+            self.snapshot, self.peak = tracemalloc.take_snapshot(), peak
+
+        tracemalloc.stop()
+
+    def _record(self, name, wall, cpu, items, rss_delta):
+
+        total = self.totals.setdefault(name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "items": 0,
+                                              "rss_delta_mb": 0.0})
+        total["calls"] += 1
+        total["wall_s"] += wall
+        total["cpu_s"] += cpu
+        total["items"] += items or 0
+        total["rss_delta_mb"] += rss_delta / MEGABYTE
+
+        if self.log is not None:
+            self.log.write(json.dumps({
+                "time": round(time.time(), 3),
+                "stage": name,
+                "wall_s": round(wall, 6),
+                "cpu_s": round(cpu, 6),
+                "items": items,
+                "items_per_s": round(items / wall, 3) if items and wall > 0 else None,
+                "rss_mb": round(current_rss() / MEGABYTE, 1),
+                "rss_delta_mb": round(rss_delta / MEGABYTE, 1),
+            }) + "\n")
+            self.log.flush()
+
+    # Calls, time, items, throughput and memory of every stage, in the order they first ran
+    def summary(self):
+
+        lines = ["%-24s %6s %10s %10s %10s %12s %10s" % ("stage", "calls", "wall s", "cpu s", "items", "items/s",
+                                                         "rss MB")]
+
+        for name, total in self.totals.items():
+            throughput = "%12.1f" % (total["items"] / total["wall_s"]) if total["items"] and total["wall_s"] > 0 \
+                else "%12s" % "-"
+            lines.append("%-24s %6d %10.3f %10.3f %10s %s %+10.1f" % (
+                name, total["calls"], total["wall_s"], total["cpu_s"], total["items"] or "-", throughput,
+                total["rss_delta_mb"]))
+
+        return "\n".join(lines)
+
+    # Profile of the stage of --profile, as a file for pstats (or snakeviz) and as text,
+    # with the lines that allocated the most memory
+    def save_profile(self):
+
+        if self.profiler is None:
+            return None
+
+        if not os.path.exists(self.profile_directory):
+            os.makedirs(self.profile_directory)
+
+        base_name = os.path.join(self.profile_directory, self.profile.replace("/", "-"))
+        self.profiler.dump_stats(base_name + ".prof")
+
+        with open(base_name + ".txt", "w") as f:
+            pstats.Stats(self.profiler, stream=f).sort_stats("cumulative").print_stats(PROFILE_LINES)
+
+            f.write("Peak of the traced memory: %.1f MB\n" % (self.peak / MEGABYTE))
+            f.write("Memory that is still allocated at the end of the stage, by line:\n")
+            for statistic in self.snapshot.statistics("lineno")[:PROFILE_LINES]:
+                f.write("%s\n" % statistic)
+
+        return base_name
+
+    def close(self):
+
+        if self.totals:
+            print(self.summary())
+
+        base_name = self.save_profile()
+        if base_name is not None:
+            print("Profile of %s is saved to %s.prof and %s.txt" % (self.profile, base_name, base_name))
+        elif self.profile is not None:
+            print("Stage %s didn't run, there is no profile" % self.profile)
+
+        if self.log is not None:
+            self.log.close()
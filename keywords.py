@@ -0,0 +1,166 @@
+import os  # For the cache file
+from itertools import chain  # For the keywords of every word in one list
+
+import numpy as np  # For the keyword ids of every book
+import pandas as pd  # For the ids of the words
+
+import dataset  # For the ids of the keywords and the signature of the books file
+
+# Keywords of every title, saved next to the CSV files and used until the books file changes
+CACHE_FILE = "keywords-cache.npz"
+
+
+# Remove non character letter such as (, ), /, \ etc
+# A word may be split in two words, so it returns a list with one or two keywords
+def _split_keyword(keyword):
+
+    temp_keyword = keyword
+    second_temp_keyword = None
+
+    # Index of the first time every character appears, instead of searching the keyword for every character
+    first_index = {}
+    for index, char in enumerate(keyword):
+        first_index.setdefault(char, index)
+
+    for char in keyword:
+
+        if char.isalpha() is False:
+
+            # Index of the next char
+            next_index = first_index[char] + 1
+
+            # If it's not the last or the first index and the next character is a letter
+            if len(keyword) > next_index != 1 and keyword[next_index].isalpha() is True:
+
+                # Replace character with space and keep these words seperate
+                both_temp_keywords = temp_keyword.replace(char, " ").split()
+
+                # If the first word isn't too short, add it to temp_keyword
+                if len(both_temp_keywords[0]) > 2:
+                    temp_keyword = both_temp_keywords[0]
+
+                # if a second word really exists
+                if len(both_temp_keywords) == 2:
+                    # And it's not too short, add it to second_temp_keyword
+                    if len(both_temp_keywords[1]) > 2:
+                        second_temp_keyword = both_temp_keywords[1]
+
+            else:
+                temp_keyword = temp_keyword.replace(char, "")
+
+    if second_temp_keyword is not None:
+        return [temp_keyword, second_temp_keyword]
+
+    return [temp_keyword]
+
+
+# Keywords of one distinct word of the titles
+# Empty list if the word is too short or has numbers
+def _word_keywords(word):
+
+    # Remove too short words
+    # Not the best way of doing the stopwords
+    # But it's definitely the quickest/easiest
+    if len(word) <= 2:
+        return []
+
+    # Remove words with numbers since they probably represent a false statement about liking of a user
+    for char in word:
+        if char.isdigit():
+            return []
+
+    keyword = word.lower()
+
+    if keyword.isalpha():
+        return [keyword]
+
+    return _split_keyword(keyword)
+
+
+# Keywords of every title at once, the same keywords that were found one title at a time before
+# Every distinct word is checked only once and the rest is done with arrays of word ids
+# Returns the keywords of book i as keyword_ids[keyword_offsets[i]:keyword_offsets[i + 1]]
+# and the list of every keyword, so keyword_ids are indexes of it
+def extract_keywords(titles):
+
+    # Split every title into words with a single split, titles are separated by a word that is only SEPARATOR
+    # The same words get the same id
+    titles = [title if isinstance(title, str) else "" for title in titles]
+    words = (" %s " % dataset.SEPARATOR).join(titles).split()
+    word_ids, words = pd.factorize(pd.Series(words, dtype=object))
+
+    # Book of every word is the amount of separators before it
+    separator = words.get_loc(dataset.SEPARATOR) if dataset.SEPARATOR in words else -1
+    word_books = np.cumsum(word_ids == separator)
+    word_ids, word_books = word_ids[word_ids != separator], word_books[word_ids != separator]
+
+    # Remove duplicates, only the first time a word appears in a title is kept
+    _, first = np.unique(word_books * max(len(words), 1) + word_ids, return_index=True)
+    first.sort()
+    word_ids, word_books = word_ids[first], word_books[first]
+
+    # Keywords of every distinct word, a word has zero, one or two of them
+    pieces = [_word_keywords(word) for word in words]
+    piece_counts = np.array([len(piece) for piece in pieces], dtype=np.int64)
+    piece_offsets = np.concatenate(([0], np.cumsum(piece_counts)))
+    piece_ids, piece_keywords = pd.factorize(pd.Series(list(chain.from_iterable(pieces)), dtype=object))
+
+    # Replace every word with its keywords
+    counts = piece_counts[word_ids]
+    starts = np.repeat(piece_offsets[word_ids] - (np.cumsum(counts) - counts), counts)
+    keyword_ids = piece_ids[starts + np.arange(len(starts))]
+    keyword_books = np.repeat(word_books, counts)
+
+    # Ids in order of first appearance
+    keyword_ids, order = pd.factorize(keyword_ids)
+    vocabulary = list(piece_keywords[order])
+    keyword_offsets = np.concatenate(([0], np.cumsum(np.bincount(keyword_books, minlength=len(titles)))))
+
+    return keyword_offsets, keyword_ids.astype(np.int32), vocabulary
+
+
+# Keywords of every book when new titles are added after the old ones, the same as extract_keywords of all of them
+# Only the new titles are split, keywords that already exist keep their ids and new ones get the next ids
+def extend_keywords(keyword_offsets, keyword_ids, vocabulary, titles):
+
+    new_offsets, new_ids, new_vocabulary = extract_keywords(titles)
+
+    known = {keyword: i for i, keyword in enumerate(vocabulary)}
+    vocabulary = list(vocabulary)
+
+    for keyword in new_vocabulary:
+        if keyword not in known:
+            known[keyword] = len(vocabulary)
+            vocabulary.append(keyword)
+
+    new_ids = np.array([known[keyword] for keyword in new_vocabulary], dtype=np.int32)[new_ids]
+
+    return (np.concatenate((keyword_offsets[:-1], new_offsets + keyword_offsets[-1])),
+            np.concatenate((keyword_ids, new_ids)).astype(np.int32), vocabulary)
+
+
+# Keywords from the cache, or from extract_keywords if the cache is missing or the books file changed
+def load_keywords(cache_file, books_file, titles):
+
+    signature = dataset.source_signature([books_file])
+
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as npz:
+            if dataset.unpack_strings(npz["sources"]) == signature:
+                vocabulary = dataset.unpack_strings(npz["vocabulary"]) if len(npz["keyword_ids"]) > 0 else []
+                return npz["keyword_offsets"], npz["keyword_ids"], vocabulary
+
+    keyword_offsets, keyword_ids, vocabulary = extract_keywords(titles)
+    save_keywords(cache_file, books_file, keyword_offsets, keyword_ids, vocabulary)
+
+    return keyword_offsets, keyword_ids, vocabulary
+
+
+def save_keywords(cache_file, books_file, keyword_offsets, keyword_ids, vocabulary):
+
+    # Write to a temporary file first, so a half written cache is never used
+    temp_file = cache_file + ".tmp"
+    with open(temp_file, "wb") as f:
+        np.savez(f, sources=dataset.pack_strings(dataset.source_signature([books_file])),
+                 vocabulary=dataset.pack_strings(vocabulary), keyword_offsets=keyword_offsets, keyword_ids=keyword_ids)
+    os.replace(temp_file, cache_file)
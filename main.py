@@ -1,10 +1,26 @@
+import argparse  # For the arguments of the command line
+import heapq  # For the top rated books
 import os  # For directory creation
-import sys  # For argv
 from operator import itemgetter
-from pathlib import Path  # Path to save results to
 
+import numpy as np  # For the ids of the books
 import pandas as pd  # For CSV
-from collections import defaultdict, OrderedDict  # For removal of unnecessary items on the lists
+import batch  # For the suggestions of every user at once
+import cache  # For the suggestions that were already found
+import candidates  # For the books that may be suggested to a user
+import dataset  # For the binary cache of the cleaned dataset
+import evaluation  # For the overlaps of every user at once
+import featurestore  # For the features of the books on disk
+import ingest  # For new ratings without cleaning everything again
+import instrument  # For the time and memory of every stage
+import keywords  # For the keywords of every title
+import minhash  # For the approximate candidates of very large catalogues
+import neighbours  # For the books that the same users rated
+import parallel  # For the users in many processes
+import scoring  # For Jaccard and Dice-coefficient of every book
+import server  # For the local recommendation service
+import shards  # For every user in many runs
+import writer  # For the suggestions and overlaps of every user in one file
 from random import randint  # For random integer
 
 
@@ -18,217 +34,64 @@ def get_from_csv(file_name):
     return [list(x) for x in df.values]
 
 
-def write_to_csv(file_name, my_list):
-    df = pd.DataFrame(my_list)
-
-    # saving the dataframe
-    df.to_csv(file_name, index=False, sep=';', encoding='ISO-8859-1')
-
-
-# Remove unnecessary books from the CSV
-def remove_books(ratings, books):
-
-    # Key is ISBN and value the amount of times it exists
-    isbn_d = defaultdict(int)
-
-    for isbn in [i[1] for i in ratings]:
-        isbn_d[isbn] += 1
-
-    isbns = [{"isbn": key, "count": value} for key, value in isbn_d.items()]
-
-    new_books = []
-
-    for isbn in isbns:
-        # If it has at least 10 ratings, add it
-        if isbn["count"] >= 10:
-            for book in books:
-                if isbn["isbn"] == book[0]:
-                    new_books.append(book)
-                    break
-
-    return new_books
-
-
-# Remove unnecessary users from the CSV
-def remove_users(ratings, users):
-
-    # Key is id and value the amount of times they exist
-    users_d = defaultdict(int)
-
-    for user in [i[0] for i in ratings]:
-        users_d[user] += 1
-
-    users_pass = [{"id": key, "count": value} for key, value in users_d.items()]
-
-    new_users = []
-
-    for user_pass in users_pass:
-        # If they have at least 5 ratings, add them
-        if user_pass["count"] >= 5:
-            for user in users:
-                if user_pass["id"] == user[0]:
-                    new_users.append(user)
-                    break
-
-    return new_users
-
-
-# Remove unnecessary ratings from CSV
-def remove_ratings(ratings, books, users):
-    new_ratings = []
-
-    # For every rating
-    for rating in ratings:
-        # If user exists and book exist too
-        if rating[0] in [i[0] for i in users] and rating[1] in [i[0] for i in books]:
-            # Keep that rating
-            new_ratings.append(rating)
-
-    return new_ratings
-
-
-def get_keywords_from_title(books):
-    # A dictionary with ISBN as key and a list of keywords as value
-    keywords = {}
+# Users, books and ratings from the binary cache, or from the CSV files if the cache is missing or old
+def load_dataset(directory, files):
 
-    for book in books:
-        isbn = book[0]
-        title = book[1]
+    cache_file = directory + dataset.CACHE_FILE
 
-        # Split title into words
-        keywords[isbn] = title.split()
+    data = dataset.load_cache(cache_file, files)
+    if data is not None:
+        print("Data is taken from the cache")
+        return data
 
-        # Remove duplicates
-        keywords[isbn] = list(OrderedDict.fromkeys(keywords[isbn]))
+    users_file, books_file, ratings_file = files
+    data = dataset.Dataset.from_ratings_file(get_from_csv(users_file), get_from_csv(books_file), ratings_file)
 
-        temp = []
-        for keyword in keywords[isbn]:
+    # Next runs don't have to parse the CSV files again
+    dataset.save_cache(cache_file, files, data)
 
-            # Remove too short words
-            # Not the best way of doing the stopwords
-            # But it's definitely the quickest/easiest
-            if len(keyword) > 2:
+    return data
 
-                # Remove words with numbers since they probably represent a false statement about liking of a user
-                valid = True
-                for char in keyword:
-                    # If any character of a word is a digit, don't add it to the keywords
-                    if char.isdigit():
-                        valid = False
-                        break
-                if valid:
-                    temp.append(keyword.lower())  # When append, transform to lowercase
 
-        # I cannot manipulate keywords[isbn] because I iterate through it, so I add a temp with the correct values
-        # And then I add it to the keywords list
-        keywords[isbn] = temp
-
-        temp_keywords = []
-
-        # Remove non character letter such as (, ), /, \ etc
-        for keyword in keywords[isbn]:
-            temp_keyword = keyword
-            second_temp_keyword = None
-            for char in keyword:
-
-                if char.isalpha() is False:
-
-                    # Index of the next char
-                    next_index = keyword.index(char) + 1
-
-                    # If it's not the last or the first index and the next character is a letter
-                    if len(keyword) > next_index != 1 and keyword[next_index].isalpha() is True:
-
-                        # Replace character with space and keep these words seperate
-                        both_temp_keywords = temp_keyword.replace(char, " ").split()
-
-                        # If the first word isn't too short, add it to temp_keyword
-                        if len(both_temp_keywords[0]) > 2:
-                            temp_keyword = both_temp_keywords[0]
-
-                        # if a second word really exists
-                        if len(both_temp_keywords) == 2:
-                            # And it's not too short, add it to second_temp_keyword
-                            if len(both_temp_keywords[1]) > 2:
-                                second_temp_keyword = both_temp_keywords[1]
-
-                    else:
-                        temp_keyword = temp_keyword.replace(char, "")
-
-            temp_keywords.append(temp_keyword)
-
-            # Add second_temp_keyword is it exists
-            if second_temp_keyword is not None:
-                temp_keywords.append(second_temp_keyword)
-
-        # Add every keyword of the current book
-        keywords[isbn] = temp_keywords
+def write_to_csv(file_name, my_list):
+    df = pd.DataFrame(my_list)
 
-    return keywords
+    # saving the dataframe
+    df.to_csv(file_name, index=False, sep=';', encoding='ISO-8859-1')
 
 
 # Get the 3 top rated books for each user
-def get_favourites(book_ratings, user_id, books):
-
-    favourites = []
-
-    # Iterate through every rating to find ratings from this specific user
-    for rating in book_ratings:
-
-        # If the rating is from this user
-        if user_id == rating[0]:
-
-            # If the book exists
-            if rating[1] in [i[0] for i in books]:
+# If two books have the same rating, the one that was rated first wins
+def get_favourites(data, user, amount=3):
 
-                to_be_inserted = [rating[1], rating[2]]
+    books, ratings = data.user_ratings(user)
 
-                # Check if the user already has 3 favourites or not
-                if len(favourites) < 3:
+    favourites = heapq.nlargest(amount, zip(books.tolist(), ratings.tolist()), key=itemgetter(1))
 
-                    # If he doesn't, insert this one
-                    favourites.append(to_be_inserted)
-                else:
-
-                    # if he does, go through these three
-                    for favourite in favourites:
-
-                        # And check if the current rating is higher than a previous one
-                        if rating[2] > favourite[1]:
-                            favourites.remove(favourite)
-                            favourites.append(to_be_inserted)
-                            break
-
-    return favourites
+    return [list(favourite) for favourite in favourites]
 
 
 # Favourite authors, years of publication and keywords from titles
-def get_preferences(favourites, books, keywords):
+def get_preferences(favourites, data):
 
     authors = []
     keywords_in_titles = []
     year_of_publications = []
 
-    for book in books:
+    # Same order as the books file
+    for user_favourite in sorted(favourites):
 
-        book_isbn = book[0]
-        book_author = book[2]
-        book_year = book[3]
+        book = user_favourite[0]
 
-        for user_favourite in favourites:
+        # Add author
+        authors.append(data.book_authors[book])
 
-            if user_favourite[0] == book_isbn:
+        # Add year of publication
+        year_of_publications.append(data.book_years[book])
 
-                # Add author
-                authors.append(book_author)
-
-                # Add year of publication
-                year_of_publications.append(book_year)
-
-                # Add keywords from titles
-                # Need to move keywords from each favourite book into one list, not three separated
-                for keyword in keywords[book_isbn]:
-                    keywords_in_titles.append(keyword)
+        # Add keywords from titles
+        # Need to move keywords from each favourite book into one list, not three separated
+        keywords_in_titles.extend(data.book_keywords(book).tolist())
 
     preferences = [authors, keywords_in_titles, year_of_publications]
 
@@ -239,201 +102,125 @@ def get_random_users(users, amount=5):
     random_users = []
 
     for i in range(amount):
-        choices = randint(0, len(users))
+        # Both ends are included, so the last index is len(users) - 1
+        choices = randint(0, len(users) - 1)
         random_users.append(users[choices])
 
     return random_users
 
 
-# Both Jaccard and Dice-coefficient are running through this
-def uniformity(books, users_preferences, keywords, type_of_uniformity):
-
-    # Add the right values
-    if type_of_uniformity is "jaccard":
-        author_value = 0.4
-        keywords_value = 0.2
-        year_value = 0.4
-    else:
-        author_value = 0.3
-        keywords_value = 0.5
-        year_value = 0.2
-
-    # User's results for every book
-    user_results = []
-
-    preferences = users_preferences
-
-    # Separate preferences for better understanding of the code
-    user_years = preferences[2]
-    user_keywords = preferences[1]
-    user_authors = preferences[0]
-
-    for book in books:
-
-        # User result is equal to 0 for every book before any calculation
-        user_result = 0
-
-        isbn = book[0]
-
-        author = book[2]
-        year = book[3]
-        keywords_from_book = keywords[isbn]
-
-        # Check author
-        if author in user_authors:
-            user_result += author_value
-
-        # Check keywords
-        if type_of_uniformity is "jaccard":
-            user_result = jaccard(user_result, user_keywords, keywords_from_book, keywords_value)
-        else:
-            user_result = dice(user_result, user_keywords, keywords_from_book, keywords_value)
-
-        # Check year of publication
-        for user_year in user_years:
-            tmp = 1 - (abs(int(year) - int(user_year)) / 2005)
-            curr_result = 0
-            if tmp > curr_result:
-                curr_result = tmp
-
-        user_result += curr_result * year_value
-
-        user_results.append([isbn, user_result])
+# Jaccard and Dice-coefficient of every book, every type of uniformity at once
+# The features that they share are computed only once
+# Returns a dictionary with the type of uniformity as key
+# If books is given, only these books are scored and the index of the result is the position in books
+def uniformities(features, users_preferences, books=None):
+    return scoring.score_profiles(features, users_preferences, books=books)
 
-    return user_results
 
+# The 10 books with the highest results for a user, as [[id of the book, result]], from the highest to the lowest
+# Books that the user already rated are not suggested
+# If books is given, results are only for these books, in the same order
+def top_results(data, results, user, amount=10, books=None):
 
-def jaccard(result, user_keywords, keywords_from_book, keywords_value):
+    if books is None:
+        books = np.arange(len(results))
 
-    common_keywords = 0
+    read_books, _ = data.user_ratings(user)
 
-    # Keywords from one set
-    keywords_from_both = keywords_from_book.copy()
+    top = scoring.top_books(results, amount, np.isin(books, read_books))
 
-    # Rest of the keywords
-    for keyword in user_keywords:
-        if keyword not in keywords_from_both:
-            keywords_from_both.append(keyword)
+    return [list(pair) for pair in zip(books[top].tolist(), results[top].tolist())]
 
-    length_both_sets = len(keywords_from_both)
 
-    # If I removed every keyword (for example "2001" because I remove numbers)
-    if len(keywords_from_book) > 0:
-        for keyword_from_book in keywords_from_book:
-            if keyword_from_book in user_keywords:
-                common_keywords += 1
+# Rows of the books file and [[ISBN, result]] of the books of top_results
+def book_suggestions(data, top):
 
-        result += (common_keywords / length_both_sets) * keywords_value
+    suggested_books = [data.book_record(book) for book, _ in top]
+    suggested_results = [[data.isbns[book], result] for book, result in top]
 
-    return result
-
-
-def dice(result, user_keywords, keywords_from_book, keywords_value):
-
-    common_keywords = 0
-
-    # If I removed every keyword (for example "2001" because I remove numbers)
-    if len(keywords_from_book) > 0:
-        for keyword_from_book in keywords_from_book:
-            if keyword_from_book in user_keywords:
-                common_keywords += 1
-
-        total_length = len(keywords_from_book) + len(user_keywords)
-
-        result += (2 * common_keywords / total_length) * keywords_value
-
-    return result
+    return suggested_books, suggested_results
 
 
-def suggest_books(books, results):
+def suggest_books(data, results, user, amount=10, books=None):
+    return book_suggestions(data, top_results(data, results, user, amount, books))
 
-    suggested_results = []
-    suggested_books = []
 
-    suggested_counter = 0
+# Favourites, preferences and top books of every type of uniformity for a user
+# It needs only the arrays of the dataset, so it can run in a worker process
+# With lsh_index, the books are the approximate candidates of candidates.lsh_books
+# With neighbour_index, the neighbours of the favourites are added to the results, see neighbours.blend
+def recommend_user(data, features, index, user, amount=10, lsh_index=None, neighbour_index=None):
 
-    for book in books:
-        for result in results:
-            # If the current result is about this book
-            if result[0] == book[0]:
-                curr_result = result[1]
+    favourites = get_favourites(data, user)
+    preferences = get_preferences(favourites, data)
 
-                # If the book is already read, don't mind about it
-                if curr_result == 1.0:
-                    continue
+    # Only the books that may be in the top 10 are scored, the rest can't be suggested anyway
+    read_books, _ = data.user_ratings(user)
+    if lsh_index is None:
+        books, results = candidates.threshold_books(index, features, preferences, read_books, amount)
+    else:
+        books, results = candidates.lsh_books(lsh_index, index, features, preferences, read_books, amount)
 
-                # If this user has 10 suggestions
-                elif suggested_counter == 10:
-                    # Check if any of the suggestions has lower result value than the current
-                    for suggested_book in suggested_results:
-                        if curr_result > suggested_book[1]:
-                            # suggested_book = result
-                            index = suggested_results.index(suggested_book)
-                            suggested_results[index] = result
-                            suggested_books[index] = book
-                            break
-                else:
-                    suggested_results.append(result)
-                    suggested_books.append(book)
-                    suggested_counter += 1
+    if neighbour_index is not None:
+        books, results = neighbours.blend(neighbour_index, features, preferences,
+                                          [favourite[0] for favourite in favourites], books, results)
 
-    return suggested_books, suggested_results
+    tops = {name: top_results(data, result, user, amount, books) for name, result in results.items()}
 
+    return favourites, preferences, tops
 
-# Write overlaps to text files
-# 3 files for each user
-# One file for Jaccard-Dice, one file for Golden-Jaccard and one for Golden-Dice
-def write_overlaps(file_name, overlap, curr_index):
 
-    # Create directory named overlaps if it does not exist
-    if not os.path.exists("overlaps/"):
-        os.makedirs("overlaps/")
+# Same as recommend_user with the MinHash index and/or the neighbour index, they are objects of the workers
+# The user is the last object, like parallel.run_users gives it
+def recommend_user_with(data, features, index, *objects):
 
-    data_folder = Path("overlaps/")
-    file = data_folder / file_name
+    lsh_index = next((item for item in objects[:-1] if isinstance(item, minhash.MinHashIndex)), None)
+    neighbour_index = next((item for item in objects[:-1] if isinstance(item, neighbours.NeighbourIndex)), None)
 
-    with open(file, 'w') as f:
-        f.write("Overlap of user %s is  => %.1f\n" % (curr_index, overlap))
+    return recommend_user(data, features, index, objects[-1], lsh_index=lsh_index, neighbour_index=neighbour_index)
 
 
-# Write suggestions to text files
-# 2 files for each user
-# One file for Jaccard and one file for Dice coefficient
-def write_suggestions(user_index, suggestions, result_type):
+# Same as recommend_user for every user, but users in the cache are not computed again
+# The rest are computed in worker processes if there are more than one, and they come back in the same order as users
+# With lsh_index, the suggestions are approximate and they have their own keys in the cache
+# With neighbour_index too, the keys have the weight and the version of the neighbours
+def recommend_users(recommendation_cache, data, features, index, users, workers=1, lsh_index=None,
+                    neighbour_index=None):
 
-    # Create directory named results if it does not exist
-    if not os.path.exists("results/"):
-        os.makedirs("results/")
+    prefix, function, objects = "", recommend_user, (data, features, index)
+    if lsh_index is not None:
+        prefix += "lsh/%d/%d/" % (lsh_index.bands, lsh_index.rows)
+        function, objects = recommend_user_with, objects + (lsh_index,)
+    if neighbour_index is not None:
+        prefix += neighbour_index.cache_key + "/"
+        function, objects = recommend_user_with, objects + (neighbour_index,)
 
-    # Name of the file is the index of user and the type of the uniformity
-    # Example: user-0-jaccard.txt
-    file_name = "user-" + user_index + "-" + result_type + ".txt"
-    data_folder = Path("results/")
-    file_name = data_folder / file_name
+    keys = [prefix + data.user_ids[user] for user in users]
+    fingerprints = [cache.rating_fingerprint(data, user) for user in users]
+    found = [recommendation_cache.get(key, fingerprint) for key, fingerprint in zip(keys, fingerprints)]
 
-    with open(file_name, 'w') as f:
-        for suggestion in suggestions:
-            f.write("ISBN: %s \t with title: %s\nAuthor is: %s and year is %s\n" % (
-                suggestion[0], suggestion[1], suggestion[2], suggestion[3]))
+    missing = [user for user, recommendation in zip(users, found) if recommendation is None]
+    computed = parallel.run_users(function, objects, missing, workers)
 
+    for key, fingerprint, recommendation in zip(keys, fingerprints, found):
+        if recommendation is None:
+            recommendation = next(computed)
+            recommendation_cache.put(key, fingerprint, recommendation)
 
-def overlap(jaccard_results, dice_results):
+        yield recommendation
 
-    for i in range(10):
-        books_from_jaccard = []
-        for j in range(i + 1):
-            books_from_jaccard.append(jaccard_results[j][0])
 
-        fraction = 0
-        for j in range(i + 1):
-            if dice_results[j][0] in books_from_jaccard:
-                fraction += 1
+# Fraction of the first 10 books of the second list that are in the first 10 books of the first list
+# If a list has less than 10 books, only as many as the shortest list are compared
+def overlap_fraction(first_results, second_results, amount=10):
 
-        fraction = fraction / (i + 1)
+    amount = min(amount, len(first_results), len(second_results))
+    if amount == 0:
+        return 0.0
 
-    print(fraction)
+    first_books = set(result[0] for result in first_results[:amount])
 
-    return fraction
+    return sum(result[0] in first_books for result in second_results[:amount]) / amount
 
 
 # This list isn't sorted because I have to check two variables: Amount of times and result
@@ -500,8 +287,146 @@ def get_golden(jaccard_results, dice_results):
     return sort_golden(goldens)
 
 
+# Suggestions, golden standard and overlaps of a user, as a record of the shard files
+def user_record(data, user, tops):
+
+    jaccard_results = [[data.isbns[book], result] for book, result in tops["jaccard"]]
+    dice_results = [[data.isbns[book], result] for book, result in tops["dice"]]
+    golden = get_golden(jaccard_results, dice_results.copy())
+
+    return {
+        "user": data.user_ids[user],
+        "jaccard": jaccard_results,
+        "dice": dice_results,
+        "golden": golden,
+        "overlap": {
+            "jaccard_dice": overlap_fraction(jaccard_results, dice_results),
+            "golden_jaccard": overlap_fraction(jaccard_results, golden),
+            "golden_dice": overlap_fraction(dice_results, golden),
+        },
+    }
+
+
+# Signature of the checkpoints of the shards
+# Checkpoints of exact and approximate suggestions, or of other neighbours, can't be mixed
+# Shards that run on other machines or in copies of the files have the same signature, so they can be merged
+def shard_signature(files, lsh_index=None, neighbour_index=None):
+
+    signature = dataset.content_signature(files)
+    if lsh_index is not None:
+        signature.append("lsh/%d/%d" % (lsh_index.bands, lsh_index.rows))
+    if neighbour_index is not None:
+        signature.append(neighbour_index.cache_key)
+
+    return "|".join(signature)
+
+
+# Every user of a shard, a checkpoint at a time
+# Saved checkpoints are skipped, so a run that was killed continues from the first missing checkpoint
+def run_shard(data, features, index, recommendation_cache, instruments, shard, shards_count, signature,
+              workers=1, checkpoint_size=shards.CHECKPOINT_SIZE, lsh_index=None, neighbour_index=None):
+
+    users = shards.shard_users(data.user_count, shard, shards_count)
+    shard_dir = shards.prepare_shard(shards.SHARD_DIRECTORY, shard, shards_count, users, signature, checkpoint_size)
+
+    parts = (len(users) + checkpoint_size - 1) // checkpoint_size
+    for part, part_users in shards.missing_checkpoints(shard_dir, users, checkpoint_size):
+
+        recommendations = list(instruments.iterate(
+            "recommend_user", recommend_users(recommendation_cache, data, features, index, part_users.tolist(), workers,
+                                              lsh_index, neighbour_index),
+            items=lambda recommendation: 1))
+
+        with instruments.stage("user_record", len(part_users)):
+            records = [user_record(data, user, tops) for user, (_, _, tops) in zip(part_users.tolist(), recommendations)]
+
+        with instruments.stage("save_checkpoint", len(records)):
+            shards.save_checkpoint(shard_dir, part, records)
+        print("Shard %d/%d: checkpoint %d of %d is saved" % (shard, shards_count, part + 1, parts))
+
+
+# Writer of the records of a mode, to --output or to the default file of the mode
+# With --legacy, every record is also written in the layout of the text files
+def open_writer(arguments, default_file, data):
+
+    legacy = writer.LegacyWriter(data) if arguments.legacy else None
+
+    return writer.open_writer(arguments.output or default_file, legacy=legacy)
+
+
+# Integer of the command line that must be at least 1
+def positive_int(text):
+
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError("%s must be at least 1" % text)
+
+    return value
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description="Book suggestions with Jaccard and Dice coefficient")
+    parser.add_argument("mode", nargs="?", choices=["start", "batch", "serve", "ingest", "all", "merge", "recall"],
+                        help="start: clean the original CSV files first, batch: suggestions of every user, "
+                             "serve: answer requests on a local HTTP endpoint, ingest: add the ratings of --delta, "
+                             "all: suggestions, golden standard and overlaps of every user of --shard, "
+                             "merge: every shard in one file, "
+                             "recall: approximate suggestions of --sample users against the exact ones")
+    parser.add_argument("--shard", default="0/1",
+                        help="i/n: the i-th of n parts of the users in mode all, the first is 0; n for merge")
+    parser.add_argument("--checkpoint-size", type=positive_int, default=shards.CHECKPOINT_SIZE,
+                        help="users of every checkpoint in mode all")
+    parser.add_argument("--output", help="file with the suggestions and overlaps of every user, "
+                                             "SQLite if it ends with .db, JSON lines otherwise")
+    parser.add_argument("--legacy", action="store_true",
+                        help="also write results/user-N-<metric>.txt and overlaps/user-N <metrics> for every user")
+    parser.add_argument("--delta", help="file with new ratings, in the same format as the ratings file")
+    parser.add_argument("--block-size", type=int, default=batch.BLOCK_SIZE,
+                        help="users that are scored at the same time in batch mode")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes that find the suggestions of the users, 0 for every core")
+    parser.add_argument("--cache-size", type=int, default=cache.CACHE_SIZE,
+                        help="users whose suggestions are kept in memory")
+    parser.add_argument("--cache-file", help="file that keeps the suggestions of the users between runs")
+    parser.add_argument("--port", type=int, default=8000, help="port of the endpoint in serve mode")
+    parser.add_argument("--approximate", action="store_true",
+                        help="candidates from a MinHash/LSH index of the keywords instead of the exact candidates")
+    parser.add_argument("--lsh-bands", type=int, default=minhash.BANDS,
+                        help="bands of the LSH index, more find more books but take more time")
+    parser.add_argument("--lsh-rows", type=int, default=minhash.ROWS,
+                        help="hash functions of every band, more find fewer books that are closer to the user")
+    parser.add_argument("--neighbour-weight", type=float, default=0.0,
+                        help="weight of the books that the same users rated, added to Jaccard and Dice; 0 is off")
+    parser.add_argument("--neighbours", type=int, default=neighbours.NEIGHBOURS,
+                        help="most similar books that the neighbour index keeps for every book")
+    parser.add_argument("--sample", type=int, default=minhash.RECALL_SAMPLE, help="users of recall mode")
+    parser.add_argument("--instrument-file",
+                        help="file that gets a JSON line with the time, items and memory of every call of a stage")
+    parser.add_argument("--profile", metavar="STAGE",
+                        help="run a stage (for example recommend_user) under cProfile and tracemalloc "
+                             "and save the profile to " + instrument.PROFILE_DIRECTORY)
+    parser.add_argument("--batch-window", type=float, default=server.BATCH_WINDOW * 1000,
+                        help="milliseconds that requests wait for others to be scored together in serve mode")
+
+    return parser.parse_args()
+
+
 def main():
 
+    arguments = parse_arguments()
+    instruments = instrument.Instruments(arguments.instrument_file, arguments.profile)
+
+    # Time, items and memory of every stage at the end, whatever the mode
+    try:
+        run(arguments, instruments)
+    finally:
+        instruments.close()
+
+
+# Every mode, every stage is measured by instruments
+def run(arguments, instruments):
+
     directory = "CSV-files/"
 
     users_file = "BX-Users.csv"
@@ -510,138 +435,282 @@ def main():
 
     # Pre-treatment 1
 
-    # If there is no arguments
-    if len(sys.argv) == 1 and os.path.exists(directory):
+    # If argument 'start' doesn't exist
+    if arguments.mode != "start" and os.path.exists(directory):
 
-        users = get_from_csv(directory + users_file)
-        books = get_from_csv(directory + books_file)
-        book_ratings = get_from_csv(directory + ratings_file)
+        files = [directory + users_file, directory + books_file, directory + ratings_file]
+        with instruments.stage("load_dataset") as measure:
+            data = load_dataset(directory, files)
+            measure["items"] = len(data.rating_books)
 
     # If argument 'start' exists
-    elif (len(sys.argv) == 2 and sys.argv[1] == "start") or not os.path.exists(directory):
+    else:
 
         # Create directory named CSV-files if it does not exist
         if os.path.exists(directory):
-            users_file = directory + users_file
-            books_file = directory + books_file
-            ratings_file = directory + ratings_file
+            source = directory
         else:
             # If directory does not exists, files must be in current directory
             # If not, they probably ran away, good luck, poof
+            source = ""
             os.makedirs(directory)
 
-        # I repeat it, because when ratings are removed, some users, still have less than 5 ratings
-        # So I need to remove even more users and even more books
-        # Eventually I have the right amount of users, books and ratings
-        # But just in case, I still check if the book and user of any rating exists furthermore on the project
-        for i in range(3):
-
-            users = get_from_csv(users_file)
-            books = get_from_csv(books_file)
-            book_ratings = get_from_csv(ratings_file)
+        with instruments.stage("get_from_csv") as measure:
+            all_users = get_from_csv(source + users_file)
+            all_books = get_from_csv(source + books_file)
+            measure["items"] = len(all_users) + len(all_books)
+
+        # Removed users, books and ratings are kept apart, new ratings may be enough for them later
+        pending = directory + ingest.PENDING_DIRECTORY
+        if not os.path.exists(pending):
+            os.makedirs(pending)
+
+        # When ratings are removed, some users still have less than 5 ratings
+        # So it keeps removing users, books and ratings until every limit holds
+        # The ratings file is read in chunks, because it is too big to keep in memory
+        with instruments.stage("pruning", len(all_users) + len(all_books)):
+            users, books = dataset.prune_ratings_file(source + ratings_file, all_users, all_books,
+                                                      directory + ratings_file, pending_file=pending + ratings_file)
+        print("Users, books and ratings were removed.")
+        print("Ratings were saved")
+
+        with instruments.stage("write_csv", len(all_users) + len(all_books)):
+            kept_users, kept_books = set(user[0] for user in users), set(book[0] for book in books)
+
+            # Added to what is already pending: start may run again on files that were already pruned,
+            # and then the pending users, books and ratings are only in the store
+            store = ingest.PendingStore(pending + ingest.PENDING_FILE)
+            store.add_users(user for user in all_users if user[0] not in kept_users)
+            store.add_books(book for book in all_books if book[0] not in kept_books)
+            for chunk in dataset.read_ratings_in_chunks(pending + ratings_file):
+                store.add_ratings(chunk.values.tolist())
+            store.remove_users(kept_users)
+            store.remove_books(kept_books)
+            store.close()
+            os.remove(pending + ratings_file)
+            print("Removed users, books and ratings are saved")
 
-            books = remove_books(book_ratings, books)
-            print("Books were removed.")
             write_to_csv(directory + books_file, books)
             print("Books are saved")
 
-            users = remove_users(book_ratings, users)
-            print("Users were removed.")
-            write_to_csv(directory + users_file, users, )
+            write_to_csv(directory + users_file, users)
             print("Users are saved")
 
-            book_ratings = remove_ratings(book_ratings, books, users)
-            print("Ratings were removed")
-            write_to_csv(directory + ratings_file, book_ratings)
-            print("Ratings were saved")
-    else:
-        print("Wrong argument(s)")
-        exit(0)
+        with instruments.stage("dataset") as measure:
+            data = dataset.Dataset.from_ratings_file(users, books, directory + ratings_file)
+            measure["items"] = len(data.rating_books)
+
+            # Cache of the cleaned dataset for the next runs
+            files = [directory + users_file, directory + books_file, directory + ratings_file]
+            dataset.save_cache(directory + dataset.CACHE_FILE, files, data)
+            print("Cache is saved")
 
     print("Data is taken from the CSV files")
 
+    # Merge mode: checkpoints of every shard in one file, every shard must be done
+    # Example: python main.py merge --shard 4
+    if arguments.mode == "merge":
+
+        try:
+            shards_count = int(arguments.shard.split("/")[-1])
+            files = shards.shard_files(shards.SHARD_DIRECTORY, shards_count)
+        except ValueError as error:
+            print("Shards can't be merged:", error)
+            return
+
+        with instruments.stage("merge") as measure, \
+                open_writer(arguments, "results/all-users.jsonl", data) as results_writer:
+            for file_name in files:
+                for record in writer.read_records(file_name):
+                    results_writer.add(record)
+
+            measure["items"] = results_writer.records
+
+        print("%d users of %d shards are saved" % (results_writer.records, shards_count))
+        return
+
     # Pre-treatment 2
 
-    keywords = get_keywords_from_title(books)
+    # Skipped if the books file didn't change since the last time
+    with instruments.stage("keywords", data.book_count):
+        data.set_keywords(*keywords.load_keywords(directory + keywords.CACHE_FILE, directory + books_file,
+                                                  data.titles))
     print("Found keywords from every book title")
 
+    # Ingest mode: ratings of a delta file are added to the CSV files, the caches and the feature store
+    # Example: python main.py ingest --delta new-ratings.csv
+    if arguments.mode == "ingest":
+        if arguments.delta is None:
+            print("Wrong argument(s): ingest needs --delta")
+            return
+
+        recommendation_cache = cache.RecommendationCache(arguments.cache_size, arguments.cache_file,
+                                                         "|".join(dataset.source_signature([directory + books_file])))
+
+        files = [directory + users_file, directory + books_file, directory + ratings_file]
+        with instruments.stage("ingest") as measure:
+            data, changed_users = ingest.ingest_file(directory, files, arguments.delta, data)
+            measure["items"] = len(changed_users)
+
+        # Only the suggestions of users with new ratings are old now
+        # If there are new books, the books file changed and every suggestion is old anyway
+        for user in changed_users:
+            recommendation_cache.invalidate(user)
+        recommendation_cache.close()
+
+        print("Ratings of %d users changed" % len(changed_users))
+        return
+
+    # Features of the books from the store, every process shares the same memory maps
+    with instruments.stage("feature_store", data.book_count):
+        store = featurestore.load_store(directory + featurestore.STORE_DIRECTORY, [directory + books_file], data)
+    features, index = store.features, store.index
+    print("Features of every book are ready")
+
+    # Approximate candidates, the index is built from the features every time
+    lsh_index = None
+    if arguments.approximate or arguments.mode == "recall":
+        with instruments.stage("minhash_index", data.book_count):
+            lsh_index = minhash.MinHashIndex(features, arguments.lsh_bands, arguments.lsh_rows)
+        print("MinHash index of every book is ready")
+
+    # Books that the same users rated, built from the pruned ratings once and kept on disk until they change
+    neighbour_index = None
+    if arguments.neighbour_weight > 0:
+        with instruments.stage("neighbours", data.book_count):
+            neighbour_index = neighbours.load_neighbours(directory + neighbours.NEIGHBOUR_DIRECTORY, files, data,
+                                                         arguments.neighbours)
+        neighbour_index.weight = arguments.neighbour_weight
+        print("Neighbours of every book are ready")
+
+    # Suggestions of the users stay valid until their ratings or the books file change
+    recommendation_cache = cache.RecommendationCache(arguments.cache_size, arguments.cache_file,
+                                                     "|".join(dataset.source_signature([directory + books_file])))
+
+    # Recall mode: approximate suggestions of a sample of users against the exact ones
+    # Example: python main.py recall --lsh-bands 16 --lsh-rows 3 --sample 500
+    if arguments.mode == "recall":
+
+        sample = np.random.default_rng(0).choice(data.user_count, min(arguments.sample, data.user_count),
+                                                 replace=False)
+        users = [(user, get_preferences(get_favourites(data, user), data)) for user in sample.tolist()]
+
+        with instruments.stage("recall", len(users)):
+            recall = minhash.measure_recall(lsh_index, index, features, data, users)
+
+        print("%d users, %d bands of %d rows" % (recall["users"], recall["bands"], recall["rows"]))
+        for name, value in recall["recall"].items():
+            print("Recall of %s: %.3f" % (name, value))
+        for kind in ["exact", "approximate"]:
+            print("%s: %.1f books and %.2f ms for every user" % (
+                kind.capitalize(), recall["scored_books"][kind], recall["milliseconds"][kind]))
+        return
+
+    # Batch mode: suggestions of every user, a block of users at a time
+    # Example: python main.py batch --block-size 512
+    if arguments.mode == "batch":
+
+        tables = []
+        with open_writer(arguments, "results/batch.jsonl", data) as results_writer:
+            blocks = batch.recommend_users(data, features, index, np.arange(data.user_count),
+                                           block_size=arguments.block_size, neighbour_index=neighbour_index)
+
+            for block_users, tops in instruments.iterate("score_block", blocks, items=lambda block: len(block[0])):
+                with instruments.stage("user_record", len(block_users)):
+                    for row, user in enumerate(block_users.tolist()):
+                        results_writer.add(user_record(data, user, batch.row_tops(tops, row)))
+
+                # Overlaps of every cutoff, for the whole block at once
+                with instruments.stage("evaluate", len(block_users)):
+                    tables.append(evaluation.evaluate([data.user_ids[user] for user in block_users.tolist()], tops)[0])
+
+                print("%d of %d users are done" % (results_writer.records, data.user_count))
+
+        print("Suggestions of every user are saved")
+
+        table = pd.concat(tables)
+        table.to_csv("results/evaluation.csv", sep=';')
+        summary = evaluation.summarize(table)
+        summary.to_csv("results/evaluation-summary.csv", sep=';')
+
+        print("Overlaps of every user are saved")
+        print(summary.loc[["jaccard_dice@10", "golden_jaccard@10", "golden_dice@10", "golden_size"],
+                          ["mean", "std", "min", "50%", "max"]])
+        return
+
+    # All mode: every user of a shard, with checkpoints
+    # Example: python main.py all --shard 0/4 --workers 8
+    if arguments.mode == "all":
+        try:
+            shard, shards_count = shards.parse_shard(arguments.shard)
+        except ValueError as error:
+            print("Wrong argument(s):", error)
+            return
+
+        run_shard(data, features, index, recommendation_cache, instruments, shard, shards_count,
+                  shard_signature(files, lsh_index, neighbour_index), arguments.workers, arguments.checkpoint_size,
+                  lsh_index, neighbour_index)
+
+        print("Cache:", recommendation_cache.stats())
+        recommendation_cache.close()
+        return
+
+    # Serve mode: the dataset and the features stay loaded and every request is answered from them
+    # Example: curl "http://127.0.0.1:8000/recommend?user=276847&metric=golden"
+    if arguments.mode == "serve":
+        server.serve(data, features, index, get_golden, recommendation_cache,
+                     port=arguments.port, window=arguments.batch_window / 1000, neighbour_index=neighbour_index)
+        recommendation_cache.close()
+        return
+
     # Recommendation system
     # Experiment 1
 
     # Keep three random users, not everyone
-    users = get_random_users(users)
+    users = get_random_users(data.user_ids)
+
+    # Favourites, preferences and top books of every user, from the cache or from the workers
+    user_indexes = [data.user_index[user] for user in users]
+    recommendations = instruments.iterate(
+        "recommend_user", recommend_users(recommendation_cache, data, features, index, user_indexes, arguments.workers,
+                                          lsh_index, neighbour_index),
+        items=lambda recommendation: 1)
 
-    # Initialization of every dict
-    users_favourites = {}
-    preferences = {}
-    results_jaccard, results_dice = {}, {}
-    suggested_books_jaccard, suggested_books_dice = {}, {}
-    suggested_results_jaccard, suggested_results_dice = {}, {}
-    golden_standard = {}
-    overlap_jaccard_dice, overlap_golden_jaccard, overlap_golden_dice = {}, {}, {}
+    # Suggestions and overlaps of every user go to a single file
+    results_writer = open_writer(arguments, "results/suggestions.jsonl", data)
 
     # Repeat the whole process for every user
-    for user in users:
+    for user, (favourites, user_preferences, tops) in zip(users, recommendations):
 
-        curr_id = user[0]
         my_index = str(users.index(user))
         print(my_index)
 
-        users_favourites[curr_id] = []
-        preferences[curr_id] = []
-        results_dice[curr_id], results_jaccard[curr_id] = [], []
-
-        # Find the 3 top rated books for every user
-        users_favourites[curr_id] = get_favourites(book_ratings, curr_id, books)
         print("Found favourite books for the random users")
-
-        # Get Data from favourite books for the random users
-        preferences[curr_id] = get_preferences(users_favourites[curr_id], books, keywords)
         print("Preferences of random users are created")
 
-        results_jaccard[curr_id] = uniformity(books, preferences[curr_id], keywords, "jaccard")
-        print("Jaccard is done")
-
-        results_dice[curr_id] = uniformity(books, preferences[curr_id], keywords, "dice")
-        print("Dice coefficient is done")
-
-        suggested_book_jaccard, suggested_result_jaccard = suggest_books(books, results_jaccard[curr_id])
-        suggested_books_jaccard[curr_id] = suggested_book_jaccard
-        suggested_results_jaccard[curr_id] = suggested_result_jaccard
-        print("Book suggestions for Jaccard has being done")
-
-        suggested_book_dice, suggested_result_dice = suggest_books(books, results_dice[curr_id])
-        suggested_books_dice[curr_id] = suggested_book_dice
-        suggested_results_dice[curr_id] = suggested_result_dice
-        print("Book suggestions for dice coefficient has being done")
+        # Experiments 1, 2 and 3: suggestions, overlaps and golden standard
+        with instruments.stage("user_record", 1):
+            record = user_record(data, data.user_index[user], tops)
+        print("Book suggestions for Jaccard and dice coefficient have been done")
 
-        write_suggestions(my_index, suggested_books_jaccard[curr_id], "jaccard")
-        write_suggestions(my_index, suggested_books_dice[curr_id], "dice")
-
-        # Experiment 2
-
-        overlap_jaccard_dice[curr_id] = overlap(suggested_results_jaccard[curr_id], suggested_results_dice[curr_id])
+        print(record["overlap"]["jaccard_dice"])
         print("Overlapping is done")
-
-        # Experiment 3
-        golden_standard[curr_id] = get_golden(suggested_results_jaccard[curr_id], suggested_results_dice[curr_id].copy())
-
-        overlap_golden_jaccard[curr_id] = overlap(suggested_results_jaccard[curr_id], golden_standard[curr_id])
+        print(record["overlap"]["golden_jaccard"])
         print("Overlap with golden and jaccard")
-        overlap_golden_dice[curr_id] = overlap(suggested_results_dice[curr_id], golden_standard[curr_id])
+        print(record["overlap"]["golden_dice"])
         print("Overlap with golden and dice")
 
-        filename = "user-" + my_index + " jaccard & dice"
-        write_overlaps(filename, overlap_jaccard_dice[curr_id], my_index)
+        with instruments.stage("write_results", 1):
+            results_writer.add(record)
 
-        filename = "user-" + my_index + " golden & jaccard"
-        write_overlaps(filename, overlap_golden_jaccard[curr_id], my_index)
+        print("User", my_index, "is done")
+        print("____________________________________________")
 
-        filename = "user-" + my_index + " golden & dice"
-        write_overlaps(filename, overlap_golden_dice[curr_id], my_index)
+    results_writer.close()
 
-        print("User", str(users.index(user)), "is done")
-        print("____________________________________________")
+    print("Cache:", recommendation_cache.stats())
+    recommendation_cache.close()
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import time  # For the time of the exact and the approximate tops
+
+import numpy as np  # For the signatures of every book at once
+
+import candidates  # For the exact and the approximate candidates
+import scoring  # For the top books
+
+# Bands of the LSH index and rows (hash functions) of every band
+# A book with Jaccard similarity s to the keywords of the user is found with probability 1 - (1 - s^rows)^bands:
+# more bands find more books but take more time, more rows find fewer books that are closer to the user
+BANDS = 32
+ROWS = 2
+
+# Users whose approximate tops are compared to the exact tops
+RECALL_SAMPLE = 200
+
+# Prime of the hash functions, (a * keyword + b) % prime
+_PRIME = (1 << 31) - 1
+
+# Hash functions that are computed at the same time, so large catalogues don't need every hash of every keyword at once
+_HASH_CHUNK = 8
+
+# Rows of a band are combined in a single key with this multiplier
+_KEY_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+# MinHash signature of the distinct keywords of every book and an LSH index of the bands of the signatures
+# The books of a user are the books with the same key as the keywords of the user in any band,
+# so a user only looks at a few buckets instead of every book
+# Books without keywords are never in the index, their keywords can't be similar to anything
+class MinHashIndex:
+
+    def __init__(self, features, bands=BANDS, rows=ROWS, seed=0):
+
+        self.bands = bands
+        self.rows = rows
+
+        rng = np.random.default_rng(seed)
+        self.hash_a = rng.integers(1, _PRIME, bands * rows)
+        self.hash_b = rng.integers(0, _PRIME, bands * rows)
+
+        offsets = features.distinct_keyword_offsets
+        books = np.flatnonzero(np.diff(offsets) > 0)
+
+        # Smallest hash of the keywords of every book, for every hash function
+        # Books without keywords are skipped, so every start of reduceat is the end of the previous book
+        signatures = np.empty((len(books), bands * rows), dtype=np.int64)
+        for start in range(0, bands * rows, _HASH_CHUNK):
+            hashes = self._hashes(features.distinct_keyword_ids, slice(start, start + _HASH_CHUNK))
+            if len(books):
+                signatures[:, start:start + _HASH_CHUNK] = np.minimum.reduceat(hashes, offsets[books], axis=0)
+
+        # Every band is sorted by key, the books of a key are next to each other
+        keys = self._band_keys(signatures)
+        order = np.argsort(keys, axis=1, kind="stable")
+        self.band_keys = np.take_along_axis(keys, order, axis=1)
+        self.band_books = books[order]
+
+    def _hashes(self, keywords, functions=slice(None)):
+
+        keywords = np.asarray(keywords, dtype=np.int64)
+
+        return (self.hash_a[functions] * keywords[:, np.newaxis] + self.hash_b[functions]) % _PRIME
+
+    # Key of every band of every signature, bands x signatures
+    def _band_keys(self, signatures):
+
+        keys = np.zeros((self.bands, len(signatures)), dtype=np.uint64)
+
+        for band in range(self.bands):
+            for row in range(self.rows):
+                keys[band] = keys[band] * _KEY_MULTIPLIER + signatures[:, band * self.rows + row].astype(np.uint64)
+
+        return keys
+
+    # Books with the same key as the keywords of the user in at least one band, sorted by id
+    def query(self, user_keywords):
+
+        user_keywords = np.unique(np.asarray(user_keywords, dtype=np.int64))
+        if len(user_keywords) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        keys = self._band_keys(self._hashes(user_keywords).min(axis=0)[np.newaxis, :])[:, 0]
+
+        found = []
+        for band, key in enumerate(keys):
+            start, end = np.searchsorted(self.band_keys[band], [key, key + np.uint64(1)])
+            found.append(self.band_books[band, start:end])
+
+        return np.unique(np.concatenate(found))
+
+
+# Exact and approximate tops of a sample of users, for every profile
+# users is a list of (id of the user, preferences of the user)
+# The approximate results are the exact results of fewer books, so a book of the approximate top is right
+# if its result is at least the N-th result of the exact top, even if another book with the same result was chosen
+# Returns the recall of every profile, the books that are scored for a user and the time of a user, in milliseconds
+def measure_recall(lsh_index, index, features, data, users, amount=10, profiles=None):
+
+    if profiles is None:
+        profiles = scoring.PROFILES
+
+    found = {name: 0 for name in profiles}
+    expected = {name: 0 for name in profiles}
+    scored = {"exact": 0, "approximate": 0}
+    seconds = {"exact": 0.0, "approximate": 0.0}
+
+    for user, preferences in users:
+
+        read_books, _ = data.user_ratings(user)
+
+        tops = {}
+        for kind in ["exact", "approximate"]:
+            start = time.perf_counter()
+
+            if kind == "exact":
+                books, results = candidates.threshold_books(index, features, preferences, read_books, amount, profiles)
+            else:
+                books, results = candidates.lsh_books(lsh_index, index, features, preferences, read_books, amount,
+                                                      profiles)
+
+            excluded = np.isin(books, read_books)
+            tops[kind] = {name: result[scoring.top_books(result, amount, excluded)] for name, result in results.items()}
+
+            seconds[kind] += time.perf_counter() - start
+            scored[kind] += len(books)
+
+        for name in profiles:
+            exact, approximate = tops["exact"][name], tops["approximate"][name]
+            if len(exact):
+                found[name] += min(int((approximate >= exact[-1]).sum()), len(exact))
+                expected[name] += len(exact)
+
+    users_count = max(len(users), 1)
+
+    return {
+        "users": len(users),
+        "bands": lsh_index.bands,
+        "rows": lsh_index.rows,
+        "recall": {name: found[name] / expected[name] if expected[name] else 1.0 for name in profiles},
+        "scored_books": {kind: scored[kind] / users_count for kind in scored},
+        "milliseconds": {kind: seconds[kind] * 1000 / users_count for kind in seconds},
+    }
@@ -0,0 +1,198 @@
+import hashlib  # For the version of the index
+
+import numpy as np  # For the pairs of books
+
+import arraystore  # For the arrays on disk
+import dataset  # For the signature of the source files
+import scoring  # For the rows of the sparse arrays
+
+# Neighbours of the books on disk, next to the CSV files
+NEIGHBOUR_DIRECTORY = "neighbours/"
+
+# Most similar books that are kept for every book
+NEIGHBOURS = 20
+
+# Books that less users rated together are never neighbours, one user is a coincidence
+MIN_CO_RATINGS = 2
+
+# Pairs of (book, book of the same user) that are counted at the same time
+# A chunk keeps about 10 arrays of 8 bytes for every pair, so 2000000 pairs are about 160 MB
+PAIR_CHUNK = 2000000
+
+ARRAYS = ["neighbour_offsets", "neighbour_books", "neighbour_similarities"]
+
+
+# Top neighbours of every book by co-ratings, as a sparse matrix in CSR form:
+# the neighbours of book i are neighbour_books[neighbour_offsets[i]:neighbour_offsets[i + 1]], the most similar first
+# Similarity is the cosine of the users of both books: users who rated both / sqrt(users of one * users of the other)
+# weight is how much the neighbours count next to the results of the profiles, it isn't saved with the index
+# version changes with the content of the files and the limits that the index was built with,
+# and it is the same for a copy of the files on another machine
+class NeighbourIndex:
+
+    def __init__(self, neighbour_offsets, neighbour_books, neighbour_similarities, weight=0.0, version=""):
+
+        self.neighbour_offsets = neighbour_offsets
+        self.neighbour_books = neighbour_books
+        self.neighbour_similarities = neighbour_similarities
+        self.weight = weight
+        self.version = version
+
+    @property
+    def book_count(self):
+        return len(self.neighbour_offsets) - 1
+
+    # Part of the keys of the cached suggestions: the ratings of every user change the neighbours,
+    # not only the ratings of the user whose fingerprint is in the cache
+    @property
+    def cache_key(self):
+        return "cf/%g/%s" % (self.weight, self.version)
+
+    # Books that are neighbours of the favourites and their score: the sum of their similarities to every favourite
+    # divided by the amount of favourites, so it is between 0 and 1 like the rest of the results
+    # Returns the books sorted by id and their scores
+    def scores(self, favourites):
+
+        favourites = np.asarray(favourites, dtype=np.int64)
+        if len(favourites) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        _, positions = scoring.csr_rows(self.neighbour_offsets, favourites)
+        books, inverse = np.unique(self.neighbour_books[positions], return_inverse=True)
+
+        return books.astype(np.int64), np.bincount(inverse, weights=self.neighbour_similarities[positions],
+                                                   minlength=len(books)) / len(favourites)
+
+
+# Neighbours of every book from the ratings of the dataset, a chunk of books at a time
+# Only the pairs of books of the same user are counted, the book x book matrix is never built
+# Memory is the arrays of the ratings and of a chunk of pairs: on data of the size of Book-Crossing the peak is about
+# 200 MB more than the dataset with the default pair_chunk, and about 1.4 GB more with 20000000
+def build_neighbours(data, neighbours=NEIGHBOURS, min_co_ratings=MIN_CO_RATINGS, pair_chunk=PAIR_CHUNK):
+
+    book_count = data.book_count
+
+    # A user counts once for a book, even with more than one rating of it
+    pairs = np.unique(data.rating_users.astype(np.int64) * book_count + data.rating_books)
+    rating_users, rating_books = pairs // book_count, pairs % book_count
+
+    user_offsets = np.concatenate(([0], np.cumsum(np.bincount(rating_users, minlength=data.user_count))))
+    book_order = np.argsort(rating_books, kind="stable")
+    book_users = rating_users[book_order]
+    book_offsets = np.concatenate(([0], np.cumsum(np.bincount(rating_books, minlength=book_count))))
+
+    user_lengths = np.diff(user_offsets)
+    book_lengths = np.diff(book_offsets)
+
+    # Pairs of every book, so every chunk of books has about pair_chunk of them
+    book_pairs = np.bincount(rating_books, weights=user_lengths[rating_users], minlength=book_count)
+    bounds = np.searchsorted(np.cumsum(book_pairs), np.arange(pair_chunk, book_pairs.sum() + pair_chunk, pair_chunk),
+                             side="right")
+    bounds = np.unique(np.concatenate(([0], np.minimum(bounds, book_count), [book_count])))
+
+    found_books, found_neighbours, found_similarities = [], [], []
+
+    for start, end in zip(bounds[:-1], bounds[1:]):
+
+        # Users of the books of the chunk, then every book of these users
+        rows, positions = scoring.csr_rows(book_offsets, np.arange(start, end))
+        users = book_users[positions]
+        user_rows, user_positions = scoring.csr_rows(user_offsets, users)
+
+        books = rows[user_rows] + start
+        others = rating_books[user_positions]
+        different = books != others
+
+        # Users in common of every pair of books of the chunk
+        keys, counts = np.unique(books[different] * book_count + others[different], return_counts=True)
+        books, others = keys // book_count, keys % book_count
+
+        kept = counts >= min_co_ratings
+        books, others, counts = books[kept], others[kept], counts[kept]
+        similarities = counts / np.sqrt(book_lengths[books].astype(np.float64) * book_lengths[others])
+
+        # The most similar neighbours of every book, the lowest id first for the same similarity
+        order = np.lexsort((others, -similarities, books))
+        books, others, similarities = books[order], others[order], similarities[order]
+        ranks = np.arange(len(books)) - np.searchsorted(books, books)
+
+        found_books.append(books[ranks < neighbours])
+        found_neighbours.append(others[ranks < neighbours])
+        found_similarities.append(similarities[ranks < neighbours])
+
+    books = np.concatenate(found_books)
+
+    return NeighbourIndex(np.concatenate(([0], np.cumsum(np.bincount(books, minlength=book_count)))),
+                          np.concatenate(found_neighbours).astype(np.int32),
+                          np.concatenate(found_similarities).astype(np.float32))
+
+
+# Version of the neighbours of the files with the limits, see NeighbourIndex
+def index_version(sources, neighbours, min_co_ratings):
+
+    signature = dataset.content_signature(sources) + [str(neighbours), str(min_co_ratings)]
+
+    return hashlib.blake2b("|".join(signature).encode("utf-8"), digest_size=8).hexdigest()
+
+
+# Write the neighbours to a directory, with the signature of the files that they were built from
+# The version is found only here, so the files are read only when the index is built
+def save_neighbours(directory, sources, neighbour_index, neighbours, min_co_ratings):
+
+    arraystore.save_arrays(directory, {attribute: getattr(neighbour_index, attribute) for attribute in ARRAYS},
+                           {"sources": dataset.source_signature(sources), "neighbours": neighbours,
+                            "min_co_ratings": min_co_ratings,
+                            "version": index_version(sources, neighbours, min_co_ratings)})
+
+
+# Neighbours from the disk with memory maps, or None if they are missing, old or built with other limits
+def open_neighbours(directory, sources, neighbours, min_co_ratings):
+
+    manifest = arraystore.read_manifest(directory)
+    if manifest is None or "version" not in manifest:
+        return None
+
+    if (manifest["sources"], manifest["neighbours"], manifest["min_co_ratings"]) != (
+            dataset.source_signature(sources), neighbours, min_co_ratings):
+        return None
+
+    return NeighbourIndex(*[arraystore.open_array(directory, attribute) for attribute in ARRAYS],
+                          version=manifest["version"])
+
+
+# Neighbours of the books of a dataset, they are built and saved only if they are missing or old
+# sources are the users, books and ratings files, new ratings change the neighbours
+def load_neighbours(directory, sources, data, neighbours=NEIGHBOURS, min_co_ratings=MIN_CO_RATINGS):
+
+    neighbour_index = open_neighbours(directory, sources, neighbours, min_co_ratings)
+    if neighbour_index is not None:
+        return neighbour_index
+
+    save_neighbours(directory, sources, build_neighbours(data, neighbours, min_co_ratings), neighbours,
+                    min_co_ratings)
+
+    return open_neighbours(directory, sources, neighbours, min_co_ratings)
+
+
+# Results of the profiles with the neighbours of the favourites added, weight times their score
+# results are the results of books, like threshold_books returns them
+# Neighbours that aren't in books are scored too: every other book has no neighbour score,
+# so if the top of books was the top of every book, the top of the blend is too
+# Returns the books sorted by id and their results for every profile
+def blend(neighbour_index, features, preferences, favourites, books, results, profiles=None):
+
+    neighbour_books, scores = neighbour_index.scores(favourites)
+
+    missing = np.setdiff1d(neighbour_books, books)
+    if len(missing):
+        missing_results = scoring.score_profiles(features, preferences, profiles, missing)
+
+        books = np.concatenate((books, missing))
+        order = np.argsort(books, kind="stable")
+        books = books[order]
+        results = {name: np.concatenate((result, missing_results[name]))[order] for name, result in results.items()}
+
+    neighbour_results = np.zeros(len(books))
+    neighbour_results[np.searchsorted(books, neighbour_books)] = scores
+
+    return books, {name: result + neighbour_index.weight * neighbour_results for name, result in results.items()}
@@ -0,0 +1,108 @@
+import mmap  # For arrays that are already memory maps of a file
+import os  # For the amount of cores
+from concurrent.futures import ProcessPoolExecutor  # For the workers
+from multiprocessing import shared_memory  # For the arrays that every worker reads
+
+import numpy as np  # For the arrays of the objects
+
+# Amount of users that a worker gets at a time
+CHUNK_SIZE = 64
+
+# Objects of this worker, their arrays are views of the shared memory of the main process
+_objects = None
+_blocks = []
+
+
+# Copy every array of the objects to shared memory, so workers read them instead of getting a copy
+# Returns the blocks of shared memory and what a worker needs to rebuild every object:
+# its class, its arrays as (name of the block, None, dtype, shape) or (file, offset, dtype, shape)
+# and its small values like the amount of keywords
+# Everything else (lists of strings, dictionaries) stays in the main process
+def share_objects(objects):
+
+    blocks = []
+    specs = []
+
+    for obj in objects:
+        arrays, values = {}, {}
+
+        for name, value in vars(obj).items():
+
+            # Arrays of the feature store are memory maps already, workers map the same file
+            if isinstance(value, np.memmap) and isinstance(value.base, mmap.mmap):
+                arrays[name] = (value.filename, value.offset, value.dtype.str, value.shape)
+
+            elif isinstance(value, np.ndarray):
+                block = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+                np.ndarray(value.shape, dtype=value.dtype, buffer=block.buf)[...] = value
+
+                blocks.append(block)
+                arrays[name] = (block.name, None, value.dtype.str, value.shape)
+
+            elif isinstance(value, (int, float, str)) or value is None:
+                values[name] = value
+
+        specs.append((type(obj), arrays, values))
+
+    return blocks, specs
+
+
+# Objects of a worker from the specs of share_objects, without calling __init__ again
+def _attach_objects(specs):
+
+    global _objects
+
+    _objects = []
+
+    for cls, arrays, values in specs:
+        obj = cls.__new__(cls)
+        obj.__dict__.update(values)
+
+        for name, (block_name, offset, dtype, shape) in arrays.items():
+
+            if offset is not None:
+                setattr(obj, name, np.memmap(block_name, dtype=dtype, mode="r", offset=offset, shape=shape))
+                continue
+
+            block = shared_memory.SharedMemory(name=block_name)
+            _blocks.append(block)
+
+            array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            array.flags.writeable = False
+            setattr(obj, name, array)
+
+        _objects.append(obj)
+
+
+def _run_chunk(function, users):
+    return [function(*_objects, user) for user in users]
+
+
+# Results of function(*objects, user) for every user, in the same order as users
+# With more than one worker, users are split into chunks and every chunk runs in a worker process
+# Workers read the arrays of the objects from shared memory, nothing big is pickled
+# function must be a module level function, so workers can find it
+# workers=0 uses every core
+def run_users(function, objects, users, workers=1, chunk_size=CHUNK_SIZE):
+
+    if workers == 0:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1 or len(users) <= 1:
+        for user in users:
+            yield function(*objects, user)
+        return
+
+    blocks, specs = share_objects(objects)
+
+    try:
+        chunks = [users[i:i + chunk_size] for i in range(0, len(users), chunk_size)]
+
+        with ProcessPoolExecutor(workers, initializer=_attach_objects, initargs=(specs,)) as executor:
+            for results in executor.map(_run_chunk, [function] * len(chunks), chunks):
+                yield from results
+
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
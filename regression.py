@@ -0,0 +1,244 @@
+import argparse  # For the arguments of the command line
+import filecmp  # For the merged files of the shards
+import os  # For the directories of the data
+import shutil  # For the removal of the data
+import sys  # For the exit code
+import tempfile  # For the directory of the data
+
+import numpy as np  # For the random users
+import batch  # For the suggestions of a block of users
+import cache  # For the caches of the shards
+import candidates  # For the threshold algorithm
+import dataset  # For the pruning and the dataset
+import evaluation  # For the golden standard of every user at once
+import instrument  # For the stages of the shards
+import keywords  # For the keywords of every title
+import main  # For the pipeline of one user
+import neighbours  # For the neighbours of the books
+import scoring  # For the features of the books
+import shards  # For the checkpoints of the shards
+import synthetic  # For the data
+import writer  # For the merged records
+
+# Users of the checks of one user at a time, every check of a block of users has the same users
+SAMPLE_USERS = 300
+
+# Shards of the merge check and the users of every checkpoint, so a shard has many checkpoints
+SHARDS = 3
+
+CHECKPOINT_SIZE = 97
+
+NEIGHBOUR_WEIGHT = 0.5
+
+
+# Every fast path against the path that it replaced, on synthetic data
+# Nothing is compared with a tolerance: the same books must come back with the same results, in the same order,
+# so a change that breaks one of them is found even if the suggestions only change for a few users
+
+
+# Dataset, features and inverted index of the synthetic data of a scale, like start and the modes after it,
+# and the files that they were built from
+def build(directory, scale, seed):
+
+    users_file, books_file, ratings_file = synthetic.generate(directory, scale, seed)[0]
+    pruned_file = os.path.join(directory, "pruned-ratings.csv")
+
+    users, books = dataset.prune_ratings_file(ratings_file, main.get_from_csv(users_file),
+                                              main.get_from_csv(books_file), pruned_file)
+
+    data = dataset.Dataset.from_ratings_file(users, books, pruned_file)
+    data.set_keywords(*keywords.extract_keywords(data.titles))
+    features = scoring.BookFeatures.from_dataset(data)
+
+    return data, features, candidates.InvertedIndex(features), [users_file, books_file, pruned_file]
+
+
+# The top books of the threshold algorithm and of a scan of every book
+def check_threshold(data, features, index, users):
+
+    wrong = 0
+    for user in users:
+        preferences = main.get_preferences(main.get_favourites(data, user), data)
+        read_books, _ = data.user_ratings(user)
+
+        books, results = candidates.threshold_books(index, features, preferences, read_books)
+        every_result = main.uniformities(features, preferences)
+
+        wrong += any(main.top_results(data, results[name], user, books=books) !=
+                     main.top_results(data, every_result[name], user) for name in every_result)
+
+    return wrong
+
+
+# The tops of a block of users and of one user at a time, with and without the neighbours
+def check_batch(data, features, index, users, neighbour_index=None):
+
+    tops = batch.score_block(data, features, index, users, neighbour_index=neighbour_index)
+
+    wrong = 0
+    for row, user in enumerate(users.tolist()):
+        wrong += batch.row_tops(tops, row) != main.recommend_user(data, features, index, user,
+                                                                  neighbour_index=neighbour_index)[2]
+
+    return wrong
+
+
+# The golden standard and the overlaps of every user at once and of main.get_golden and main.overlap_fraction
+def check_golden(data, features, index, users):
+
+    tops = batch.score_block(data, features, index, users)
+    table, (golden_books, golden_times, golden_results) = evaluation.evaluate(
+        [data.user_ids[user] for user in users.tolist()], tops)
+
+    wrong = 0
+    for row, user in enumerate(users.tolist()):
+        record = main.user_record(data, user, batch.row_tops(tops, row))
+
+        golden = [[data.isbns[book], times, result] for book, times, result in zip(
+            golden_books[row].tolist(), golden_times[row].tolist(), golden_results[row].tolist()) if book >= 0]
+        overlaps = {name: table[name + "@10"].iloc[row] for name in record["overlap"]}
+
+        wrong += golden != record["golden"] or overlaps != record["overlap"]
+
+    return wrong
+
+
+# Records of every shard of a run merged in one file, like merge mode
+def merge_shards(data, features, index, shards_count, checkpoint_size, file_name):
+
+    instruments = instrument.Instruments()
+    signature = "regression/%d" % shards_count
+
+    for shard in range(shards_count):
+        main.run_shard(data, features, index, cache.RecommendationCache(), instruments, shard, shards_count,
+                       signature, checkpoint_size=checkpoint_size)
+
+    with writer.open_writer(file_name) as results_writer:
+        for checkpoint_file in shards.shard_files(shards.SHARD_DIRECTORY, shards_count):
+            for record in writer.read_records(checkpoint_file):
+                results_writer.add(record)
+
+
+# The merged files of one shard and of many shards with many checkpoints, and the file of batch mode
+# Shards are written to shards.SHARD_DIRECTORY, so this runs in the directory of the data
+def check_shards(data, features, index, shards_count=SHARDS, checkpoint_size=CHECKPOINT_SIZE):
+
+    merge_shards(data, features, index, 1, data.user_count, "one-shard.jsonl")
+    merge_shards(data, features, index, shards_count, checkpoint_size, "shards.jsonl")
+
+    with writer.open_writer("batch.jsonl") as results_writer:
+        for block_users, tops in batch.recommend_users(data, features, index, np.arange(data.user_count)):
+            for row, user in enumerate(block_users.tolist()):
+                results_writer.add(main.user_record(data, user, batch.row_tops(tops, row)))
+
+    return (not filecmp.cmp("one-shard.jsonl", "shards.jsonl", shallow=False)) + \
+        (not filecmp.cmp("one-shard.jsonl", "batch.jsonl", shallow=False))
+
+
+# Neighbours with another amount of neighbours have another version: checkpoints and cached suggestions of the first
+# ones are never used with the second ones, and the merged shards are the suggestions of the second ones
+# A copy of the files has the same version, so shards that ran on copies can be merged
+# Shards and caches are written to the directory of the data
+def check_neighbour_versions(data, features, index, files, users):
+
+    first = neighbours.load_neighbours(neighbours.NEIGHBOUR_DIRECTORY, files, data, neighbours.NEIGHBOURS)
+    other = neighbours.load_neighbours(neighbours.NEIGHBOUR_DIRECTORY, files, data, 1)
+    first.weight = other.weight = NEIGHBOUR_WEIGHT
+
+    copies = [shutil.copy(file_name, "copy-" + os.path.basename(file_name)) for file_name in files]
+    copied = neighbours.load_neighbours("copy-" + neighbours.NEIGHBOUR_DIRECTORY, copies, data, neighbours.NEIGHBOURS)
+    copied.weight = NEIGHBOUR_WEIGHT
+
+    wrong = (first.cache_key == other.cache_key) + (copied.cache_key != first.cache_key)
+    wrong += main.shard_signature(copies, neighbour_index=copied) != main.shard_signature(files, neighbour_index=first)
+
+    # Cache on disk, every user is found with the first neighbours and none of them with the others
+    for neighbour_index in (first, other):
+        recommendation_cache = cache.RecommendationCache(disk_file="neighbours-cache")
+        recommendations = list(main.recommend_users(recommendation_cache, data, features, index, users.tolist(),
+                                                    neighbour_index=neighbour_index))
+        hits = recommendation_cache.stats()["hits"]
+        recommendation_cache.close()
+
+    wrong += hits > 0
+    wrong += sum(recommendation[2] != main.recommend_user(data, features, index, user, neighbour_index=other)[2]
+                 for user, recommendation in zip(users.tolist(), recommendations))
+
+    # Checkpoints of one shard, the first neighbours and then the others
+    for neighbour_index in (first, other):
+        main.run_shard(data, features, index, cache.RecommendationCache(), instrument.Instruments(), 0, 1,
+                       main.shard_signature(files, neighbour_index=neighbour_index), checkpoint_size=CHECKPOINT_SIZE,
+                       neighbour_index=neighbour_index)
+
+    records = [record for checkpoint_file in shards.shard_files(shards.SHARD_DIRECTORY, 1)
+               for record in writer.read_records(checkpoint_file)]
+    wrong += sum(record != main.user_record(data, user, main.recommend_user(data, features, index, user,
+                                                                            neighbour_index=other)[2])
+                 for user, record in enumerate(records))
+
+    return wrong
+
+
+def parse_arguments():
+
+    parser = argparse.ArgumentParser(description="Fast paths against the paths that they replaced on synthetic data")
+    parser.add_argument("--scale", type=float, default=0.05,
+                        help="size of the data, 1 is about the size of Book-Crossing")
+    parser.add_argument("--sample", type=int, default=SAMPLE_USERS, help="users of the checks of one user at a time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--directory",
+                        help="directory of the data, without it the data is in a temporary directory that is removed")
+
+    return parser.parse_args()
+
+
+def regression():
+
+    arguments = parse_arguments()
+
+    directory = os.path.abspath(arguments.directory or tempfile.mkdtemp(prefix="regression-"))
+    working_directory = os.getcwd()
+
+    try:
+        data, features, index, files = build(directory, arguments.scale, arguments.seed)
+        print("%d users, %d books and %d ratings" % (data.user_count, data.book_count, len(data.rating_books)))
+
+        users = np.random.default_rng(arguments.seed).choice(data.user_count, min(arguments.sample, data.user_count),
+                                                             replace=False)
+
+        neighbour_index = neighbours.build_neighbours(data, neighbours.NEIGHBOURS, neighbours.MIN_CO_RATINGS)
+        neighbour_index.weight = NEIGHBOUR_WEIGHT
+
+        # Shards are written next to the data
+        os.chdir(directory)
+
+        checks = [
+            ("threshold top-N = scan of every book", lambda: check_threshold(data, features, index, users.tolist())),
+            ("batch = one user at a time", lambda: check_batch(data, features, index, users)),
+            ("batch = one user at a time, with neighbours",
+             lambda: check_batch(data, features, index, users, neighbour_index)),
+            ("golden standard and overlaps = main.get_golden", lambda: check_golden(data, features, index, users)),
+            ("merged shards = one shard = batch, byte for byte", lambda: check_shards(data, features, index)),
+            ("other neighbours = other checkpoints and cache",
+             lambda: check_neighbour_versions(data, features, index, files, users)),
+        ]
+
+        failed = 0
+        for name, check in checks:
+            wrong = check()
+            print("%-50s %s" % (name, "ok" if wrong == 0 else "FAILED (%d)" % wrong))
+            failed += wrong > 0
+
+        print("%d of %d checks failed" % (failed, len(checks)))
+
+        return failed
+
+    # The data is removed even if a check raises, and its error is shown as it is
+    finally:
+        os.chdir(working_directory)
+        if arguments.directory is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(1 if regression() else 0)
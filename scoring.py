@@ -0,0 +1,261 @@
+import numpy as np  # For the scores of every book at once
+
+# Every type of uniformity: the similarity of keywords it uses and the weights of author, keywords and year
+# More profiles can be added here, they are all scored in the same pass
+PROFILES = {
+    "jaccard": ("jaccard", 0.4, 0.2, 0.4),
+    "dice": ("dice", 0.3, 0.5, 0.2),
+}
+
+
+# Everything about the books that the scores need, computed once for every user
+# Keywords are a sparse book x keyword matrix in CSR form:
+# the keywords of book i are keyword_ids[keyword_offsets[i]:keyword_offsets[i + 1]]
+class BookFeatures:
+
+    def __init__(self, book_authors, book_years, keyword_offsets, keyword_ids, keyword_count):
+
+        self.book_authors = book_authors
+        self.book_years = book_years
+        self.keyword_offsets = keyword_offsets
+        self.keyword_ids = keyword_ids
+        self.keyword_count = keyword_count
+
+        # Amount of keywords of every book, a keyword may be there twice (for example "The" and "the")
+        self.keyword_lengths = np.diff(keyword_offsets)
+
+        # Book of every keyword of the matrix
+        self.keyword_books = np.repeat(np.arange(self.book_count), self.keyword_lengths)
+
+        # Same matrix without the keywords that are there twice, for the size of the union of two sets
+        _, first, repeats = np.unique(self.keyword_books * max(keyword_count, 1) + keyword_ids,
+                                      return_index=True, return_counts=True)
+        self.distinct_keyword_books = self.keyword_books[first]
+        self.distinct_keyword_ids = keyword_ids[first]
+        self.distinct_keyword_repeats = repeats
+        self.distinct_keyword_offsets = np.concatenate((
+            [0], np.cumsum(np.bincount(self.distinct_keyword_books, minlength=self.book_count))))
+
+        # Years are a small domain, so the proximity of every distinct year is computed once for a user
+        # and every book gets the value of its year from that table
+        self.years, self.book_year_ids = np.unique(book_years, return_inverse=True)
+
+    @classmethod
+    def from_dataset(cls, data):
+        return cls(data.book_authors, data.book_years, data.keyword_offsets, data.keyword_ids, len(data.keywords))
+
+    @property
+    def book_count(self):
+        return len(self.book_authors)
+
+
+# Keywords of the user as a vector with True for every keyword they like
+def _keyword_vector(features, user_keywords):
+
+    vector = np.zeros(features.keyword_count, dtype=bool)
+    vector[np.asarray(user_keywords, dtype=np.int64)] = True
+
+    return vector
+
+
+# Values of an array for some books only, or for every book if books is None
+def _of_books(values, books):
+    return values if books is None else values[books]
+
+
+# Positions of the keywords of some books in a CSR matrix, and the position of the book of every one of them
+def csr_rows(offsets, books):
+
+    starts = offsets[books]
+    lengths = offsets[books + 1] - starts
+
+    rows = np.repeat(np.arange(len(books)), lengths)
+    positions = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
+
+    return rows, positions
+
+
+# Sparse matrix-vector product of some rows of a CSR matrix, or of all of them if books is None
+def _matrix_vector(offsets, matrix_books, matrix_ids, vector, books):
+
+    if books is None:
+        return np.bincount(matrix_books, weights=vector[matrix_ids], minlength=len(offsets) - 1)
+
+    rows, positions = csr_rows(offsets, books)
+
+    return np.bincount(rows, weights=vector[matrix_ids[positions]], minlength=len(books))
+
+
+# Amount of keywords of every book that the user likes, with one sparse matrix-vector product
+def keyword_intersections(features, vector, books=None):
+    return _matrix_vector(features.keyword_offsets, features.keyword_books, features.keyword_ids, vector, books)
+
+
+# Size of the union of the keywords of every book and the keywords of the user
+# Keywords that are there twice in a book count twice, like they did in the lists
+def keyword_unions(features, vector, books=None):
+
+    distinct_intersections = _matrix_vector(features.distinct_keyword_offsets, features.distinct_keyword_books,
+                                            features.distinct_keyword_ids, vector, books)
+
+    return _of_books(features.keyword_lengths, books) + vector.sum() - distinct_intersections
+
+
+def jaccard(intersections, unions):
+
+    # If I removed every keyword (for example "2001" because I remove numbers), unions of these books are useless
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return intersections / unions
+
+
+def dice(intersections, book_lengths, user_length):
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 2 * intersections / (book_lengths + user_length)
+
+
+# 1 if the author of the book is one of the favourite authors of the user, 0 if not
+def author_matches(features, user_authors, books=None):
+    return np.isin(_of_books(features.book_authors, books), np.asarray(user_authors, dtype=features.book_authors.dtype))
+
+
+# How close is the year of publication of every book to the closest year of the favourite books of the user
+def year_proximity(features, user_years, books=None):
+
+    return years_proximity(features.years, user_years)[_of_books(features.book_year_ids, books)]
+
+
+# Same as year_proximity, for any array of years
+# The best of every favourite year counts, 1 for the same year and 0 for 2005 years or more apart
+# Invalid years (0) are never close to anything: these books get 0 and these favourites are ignored
+def years_proximity(book_years, user_years):
+
+    book_years = np.asarray(book_years, dtype=np.int64)
+    user_years = np.asarray(user_years, dtype=np.int64)
+    user_years = np.unique(user_years[user_years > 0])
+
+    if len(user_years) == 0:
+        return np.zeros(len(book_years))
+
+    # Distance to the closest favourite year, it has the highest proximity of all of them
+    distances = np.abs(book_years[:, np.newaxis] - user_years[np.newaxis, :]).min(axis=1)
+
+    proximity = np.maximum(1 - (distances / 2005), 0)
+    proximity[book_years <= 0] = 0
+
+    return proximity
+
+
+# Everything about every book and a user that doesn't depend on the weights
+# Computed once, no matter how many profiles are scored
+# If books is given, only for these books
+def user_matches(features, preferences, books=None):
+
+    user_authors, user_keywords, user_years = preferences
+
+    vector = _keyword_vector(features, user_keywords)
+
+    return {
+        "author": author_matches(features, user_authors, books),
+        "intersections": keyword_intersections(features, vector, books),
+        "unions": keyword_unions(features, vector, books),
+        "lengths": _of_books(features.keyword_lengths, books),
+        "user_keywords": len(user_keywords),
+        "year": year_proximity(features, user_years, books),
+    }
+
+
+# Similarity of the keywords of every book, with the matches of user_matches
+def keyword_similarity(matches, metric):
+
+    if metric == "jaccard":
+        similarity = jaccard(matches["intersections"], matches["unions"])
+    else:
+        similarity = dice(matches["intersections"], matches["lengths"], matches["user_keywords"])
+
+    # Books without keywords don't get any result from them
+    # Books are the last axis, so it works for a block of users too
+    similarity[..., matches["lengths"] == 0] = 0
+
+    return similarity
+
+
+# Results of every book for a user, for every profile at once
+# Returns a dictionary with the name of the profile as key and the results as value, the index is the id of the book
+# If books is given, only these books are scored and the index is the position in books
+def score_profiles(features, preferences, profiles=None, books=None):
+    return profile_results(user_matches(features, preferences, books), profiles)
+
+
+# Results of every profile from the matches of user_matches
+# Matches may also be arrays of users x books, then the results are too
+def profile_results(matches, profiles=None):
+
+    if profiles is None:
+        profiles = PROFILES
+
+    similarities = {}
+    results = {}
+
+    for name, (metric, author_value, keywords_value, year_value) in profiles.items():
+
+        # Profiles with the same similarity share it
+        if metric not in similarities:
+            similarities[metric] = keyword_similarity(matches, metric)
+
+        result = matches["author"] * author_value
+        result += similarities[metric] * keywords_value
+        result += matches["year"] * year_value
+
+        results[name] = result
+
+    return results
+
+
+# Same as top_books, for every row of a users x books array of results
+# Returns an array of users x amount, rows with less books than amount end with -1
+def top_books_of_rows(results, amount):
+
+    amount = min(amount, results.shape[1])
+    top = np.full((results.shape[0], max(amount, 0)), -1, dtype=np.int64)
+    if amount <= 0:
+        return top
+
+    # Result of the N-th best book of every row, only the books that aren't worse are sorted
+    thresholds = -np.partition(-results, amount - 1, axis=1)[:, amount - 1]
+    rows, books = np.nonzero((results >= thresholds[:, np.newaxis]) & np.isfinite(results))
+
+    order = np.lexsort((books, -results[rows, books], rows))
+    rows, books = rows[order], books[order]
+
+    # Position of every book in its row
+    starts = np.searchsorted(rows, rows)
+    ranks = np.arange(len(rows)) - starts
+    kept = ranks < amount
+
+    top[rows[kept], ranks[kept]] = books[kept]
+
+    return top
+
+
+# Ids of the books with the highest results, from the highest to the lowest
+# Excluded books (for example books the user already read) are never chosen
+# If two books have the same result, the one with the lowest id wins
+def top_books(results, amount, excluded=None):
+
+    results = np.array(results, dtype=np.float64)
+    if excluded is not None:
+        results[excluded] = -np.inf
+
+    amount = min(amount, int(np.isfinite(results).sum()))
+    if amount <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Result of the N-th best book, without sorting all of them
+    threshold = results[np.argpartition(-results, amount - 1)[:amount]].min()
+
+    above = np.flatnonzero(results > threshold)
+    equal = np.flatnonzero(results == threshold)[:amount - len(above)]
+    top = np.concatenate((above, equal))
+
+    return top[np.lexsort((top, -results[top]))]
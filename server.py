@@ -0,0 +1,249 @@
+import json  # For the answers
+import queue  # For the requests that wait for the next batch
+import signal  # For a stop with kill
+import threading  # For the thread that scores the batches
+import time  # For the latency of every request
+from collections import deque  # For the latest latencies
+from concurrent.futures import Future  # For the answer of every request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # For the local endpoint
+from urllib.parse import parse_qs, urlparse  # For the arguments of a request
+
+import numpy as np  # For the percentiles
+
+import batch  # For the scores of many users at once
+import cache  # For the fingerprint of the ratings of a user
+
+# Requests that arrive within this many seconds of the first one are scored together
+BATCH_WINDOW = 0.005
+
+# Most users that are scored together
+MAX_BATCH_SIZE = 256
+
+# Most books of a request, every user of a batch gets the top of the largest amount of the batch
+MAX_AMOUNT = 100
+
+# Latencies that are kept for the percentiles
+LATENCY_WINDOW = 10000
+
+METRICS = ["jaccard", "dice", "golden"]
+
+
+# Collects the requests of many threads and scores them in a single call to batch.score_block
+class MicroBatcher:
+
+    def __init__(self, data, features, index, window=BATCH_WINDOW, max_size=MAX_BATCH_SIZE, neighbour_index=None):
+
+        self.data = data
+        self.features = features
+        self.index = index
+        self.neighbour_index = neighbour_index
+        self.window = window
+        self.max_size = max_size
+
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.batched_users = 0
+
+        threading.Thread(target=self._run, daemon=True).start()
+
+    # Top books of every profile for a user, it waits until the batch of the user is scored
+    def submit(self, user, amount):
+
+        future = Future()
+        self.requests.put((user, amount, future))
+
+        return future.result()
+
+    def _next_batch(self):
+
+        requests = [self.requests.get()]
+        deadline = time.monotonic() + self.window
+
+        while len(requests) < self.max_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+
+            try:
+                requests.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        return requests
+
+    def _run(self):
+
+        while True:
+            requests = self._next_batch()
+
+            try:
+                amount = max(request[1] for request in requests)
+                tops = batch.score_block(self.data, self.features, self.index,
+                                         [request[0] for request in requests], amount,
+                                         neighbour_index=self.neighbour_index)
+            except Exception as error:
+                for _, _, future in requests:
+                    future.set_exception(error)
+                continue
+
+            self.batches += 1
+            self.batched_users += len(requests)
+
+            for row, (_, amount, future) in enumerate(requests):
+                future.set_result(batch.row_tops(tops, row, amount))
+
+
+# Latency of the latest requests, in milliseconds
+class LatencyRecorder:
+
+    def __init__(self, size=LATENCY_WINDOW):
+
+        self.latencies = deque(maxlen=size)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+
+        with self.lock:
+            self.latencies.append(seconds * 1000)
+            self.requests += 1
+
+    def summary(self):
+
+        with self.lock:
+            latencies = np.array(self.latencies)
+            requests = self.requests
+
+        if len(latencies) == 0:
+            return {"requests": requests, "p50_ms": None, "p99_ms": None}
+
+        return {"requests": requests,
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 3)}
+
+
+# GET /recommend?user=<user id>&metric=<jaccard, dice or golden>&amount=<N>
+# GET /stats for the latency and the size of the batches
+class RequestHandler(BaseHTTPRequestHandler):
+
+    # Set by serve
+    batcher = None
+    latencies = None
+    get_golden = None
+    recommendation_cache = None
+
+    def do_GET(self):
+
+        start = time.perf_counter()
+        url = urlparse(self.path)
+
+        if url.path == "/stats":
+            stats = self.latencies.summary()
+            stats["batches"] = self.batcher.batches
+            stats["mean_batch_size"] = self.batcher.batched_users / self.batcher.batches if self.batcher.batches else 0
+            stats["cache"] = self.recommendation_cache.stats()
+            self._answer(200, stats)
+            return
+
+        if url.path != "/recommend":
+            self._answer(404, {"error": "unknown path %s" % url.path})
+            return
+
+        arguments = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        user = self.batcher.data.user_index.get(arguments.get("user"))
+        metric = arguments.get("metric", "jaccard")
+
+        if user is None:
+            self._answer(404, {"error": "unknown user %s" % arguments.get("user")})
+            return
+
+        if metric not in METRICS:
+            self._answer(400, {"error": "metric must be one of %s" % ", ".join(METRICS)})
+            return
+
+        try:
+            amount = int(arguments.get("amount", 10))
+        except ValueError:
+            self._answer(400, {"error": "amount must be an integer"})
+            return
+
+        if not 1 <= amount <= MAX_AMOUNT:
+            self._answer(400, {"error": "amount must be between 1 and %d" % MAX_AMOUNT})
+            return
+
+        # Tops of the user from the cache, unless the ratings of the user changed
+        key = "serve/%s/%d" % (arguments["user"], amount)
+        if self.batcher.neighbour_index is not None:
+            key += "/" + self.batcher.neighbour_index.cache_key
+        fingerprint = cache.rating_fingerprint(self.batcher.data, user)
+        tops = self.recommendation_cache.get(key, fingerprint)
+
+        if tops is None:
+            try:
+                tops = self.batcher.submit(user, amount)
+            except Exception as error:
+                self._answer(500, {"error": str(error)})
+                return
+
+            self.recommendation_cache.put(key, fingerprint, tops)
+
+        self._answer(200, {"user": arguments["user"], "metric": metric, "books": self._books(tops, metric)})
+
+        self.latencies.record(time.perf_counter() - start)
+
+    def _books(self, tops, metric):
+
+        data = self.batcher.data
+
+        if metric != "golden":
+            return [dict(zip(["isbn", "title", "author", "year"], data.book_record(book)), result=result)
+                    for book, result in tops[metric]]
+
+        jaccard_results = [[data.isbns[book], result] for book, result in tops["jaccard"]]
+        dice_results = [[data.isbns[book], result] for book, result in tops["dice"]]
+
+        return [{"isbn": isbn, "times": times, "result": result}
+                for isbn, times, result in self.get_golden(jaccard_results, dice_results)]
+
+    def _answer(self, status, body):
+
+        answer = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    # Every request is in the latencies, there is no need for a line per request
+    def log_message(self, format, *args):
+        pass
+
+
+def _stop(signal_number, frame):
+    raise KeyboardInterrupt
+
+
+# Answer requests until Ctrl+C or kill, the dataset and the features stay in memory the whole time
+# get_golden is the golden standard of main, from the tops of Jaccard and Dice
+# With neighbour_index, the neighbours of the favourites are added to the results
+def serve(data, features, index, get_golden, recommendation_cache, host="127.0.0.1", port=8000, window=BATCH_WINDOW,
+          neighbour_index=None):
+
+    RequestHandler.batcher = MicroBatcher(data, features, index, window, neighbour_index=neighbour_index)
+    RequestHandler.latencies = LatencyRecorder()
+    RequestHandler.get_golden = staticmethod(get_golden)
+    RequestHandler.recommendation_cache = recommendation_cache
+
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    signal.signal(signal.SIGTERM, _stop)
+    print("Serving on http://%s:%d/recommend?user=<id>&metric=<%s>" % (host, port, "|".join(METRICS)))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("Latency:", RequestHandler.latencies.summary())
+        print("Cache:", recommendation_cache.stats())
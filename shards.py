@@ -0,0 +1,114 @@
+import json  # For the checkpoints and the manifest of a shard
+import os  # For the directories of the shards
+import shutil  # For the removal of old checkpoints
+
+import numpy as np  # For the users of a shard
+
+# Every shard has its own directory here, with a manifest and a file for every checkpoint
+SHARD_DIRECTORY = "shards/"
+
+MANIFEST_FILE = "manifest.json"
+
+# Users of every checkpoint
+CHECKPOINT_SIZE = 1000
+
+
+# "i/n" of the command line as (i, n), the first shard is 0
+def parse_shard(text):
+
+    try:
+        shard, shards = [int(value) for value in text.split("/")]
+    except ValueError:
+        raise ValueError("shard must be i/n, for example 0/4, not %s" % text)
+
+    if shards < 1 or not 0 <= shard < shards:
+        raise ValueError("shard must be between 0/%d and %d/%d" % (shards, shards - 1, shards))
+
+    return shard, shards
+
+
+# Users of a shard, every shard gets the next range of ids so all of them together are every user once
+def shard_users(user_count, shard, shards):
+    return np.arange(user_count * shard // shards, user_count * (shard + 1) // shards)
+
+
+def shard_directory(directory, shard, shards):
+    return os.path.join(directory, "shard-%d-of-%d" % (shard, shards))
+
+
+def _checkpoint_file(shard_dir, part):
+    return os.path.join(shard_dir, "part-%05d.jsonl" % part)
+
+
+# Directory of a shard, ready for its checkpoints
+# Checkpoints of a different dataset or a different checkpoint size are removed, they can't be used
+def prepare_shard(directory, shard, shards, users, signature, checkpoint_size=CHECKPOINT_SIZE):
+
+    shard_dir = shard_directory(directory, shard, shards)
+    manifest = {"signature": signature, "users": len(users), "checkpoint_size": checkpoint_size,
+                "parts": (len(users) + checkpoint_size - 1) // checkpoint_size}
+
+    manifest_file = os.path.join(shard_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            if json.load(f) == manifest:
+                return shard_dir
+
+        print("Checkpoints of shard %d/%d are old, it starts from the beginning" % (shard, shards))
+        shutil.rmtree(shard_dir)
+
+    os.makedirs(shard_dir)
+    with open(manifest_file, "w") as f:
+        json.dump(manifest, f)
+
+    return shard_dir
+
+
+# Checkpoints that aren't saved yet, as (number of the checkpoint, its users)
+def missing_checkpoints(shard_dir, users, checkpoint_size=CHECKPOINT_SIZE):
+
+    for part, start in enumerate(range(0, len(users), checkpoint_size)):
+        if not os.path.exists(_checkpoint_file(shard_dir, part)):
+            yield part, users[start:start + checkpoint_size]
+
+
+# Save the records of the users of a checkpoint, a JSON line for every user
+# A checkpoint is written to a temporary file first, so it either exists whole or it doesn't exist
+def save_checkpoint(shard_dir, part, records):
+
+    file_name = _checkpoint_file(shard_dir, part)
+
+    with open(file_name + ".tmp", "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(record) + "\n" for record in records)
+
+    os.replace(file_name + ".tmp", file_name)
+
+
+# Checkpoint files of every shard, in the order of the users, for the writer of the merged records
+# Every shard must have every checkpoint and the same dataset, or nothing is merged
+def shard_files(directory, shards):
+
+    manifests = []
+    for shard in range(shards):
+        manifest_file = os.path.join(shard_directory(directory, shard, shards), MANIFEST_FILE)
+        if not os.path.exists(manifest_file):
+            raise ValueError("shard %d/%d didn't run" % (shard, shards))
+
+        with open(manifest_file) as f:
+            manifests.append(json.load(f))
+
+    if len(set(manifest["signature"] for manifest in manifests)) > 1:
+        raise ValueError("shards of %d ran with different datasets" % shards)
+
+    files = []
+    for shard, manifest in enumerate(manifests):
+        shard_dir = shard_directory(directory, shard, shards)
+        missing = [part for part in range(manifest["parts"]) if not os.path.exists(_checkpoint_file(shard_dir, part))]
+
+        if missing:
+            raise ValueError("shard %d/%d has %d of %d checkpoints" % (
+                shard, shards, manifest["parts"] - len(missing), manifest["parts"]))
+
+        files.extend(_checkpoint_file(shard_dir, part) for part in range(manifest["parts"]))
+
+    return files
@@ -0,0 +1,197 @@
+import argparse  # For the arguments of the command line
+import csv  # For the quotes of the BX files
+import os  # For the directory of the files
+
+import numpy as np  # For the random values
+import pandas as pd  # For CSV
+
+# Size of the Book-Crossing dataset, scale 1 writes about as many users, books and ratings
+BX_USERS = 278858
+BX_BOOKS = 271379
+BX_RATINGS = 1149780
+
+# Most of the ratings of the Book-Crossing dataset are 0 (implicit), the rest are mostly 7 to 10
+RATING_VALUES = np.arange(11)
+RATING_WEIGHTS = np.array([62.0, 0.4, 0.4, 0.8, 0.8, 3.4, 2.6, 6.5, 8.7, 6.8, 7.6])
+
+# Ratings of ISBNs that aren't in the books file, like in the Book-Crossing dataset
+UNKNOWN_ISBNS = 0.1
+
+# Words that many titles share, the rest of the words are made of syllables
+COMMON_WORDS = ["The", "the", "of", "a", "A", "and", "in", "to", "for", "My", "Love", "Life", "Book", "Night", "World",
+                "Secret", "House", "Death", "Man", "Girl", "Story", "Guide", "New", "Little", "Last", "Dark", "Heart"]
+SYLLABLES = ["ka", "lo", "mi", "ra", "ten", "vor", "el", "an", "dri", "su", "mo", "bel", "cas", "tor", "li", "ne",
+             "gar", "ro", "sé", "fa", "nü", "qua", "zen", "hol", "pe", "dan", "ti", "wen", "ar", "ço"]
+
+FIRST_NAMES = ["John", "Mary", "Stephen", "Anne", "James", "Nora", "Dean", "Danielle", "Michael", "Sue", "Robert",
+               "Janet", "Tom", "Patricia", "Terry", "Agatha", "Dan", "Barbara", "Isabel", "José", "Jürgen", "Ann M."]
+LAST_NAMES = ["King", "Roberts", "Koontz", "Steel", "Grisham", "Grafton", "Evanovich", "Clancy", "Pratchett",
+              "Christie", "Brown", "Kingsolver", "Allende", "Saramago", "Martin", "Rice", "Cornwell", "Clark",
+              "Higgins", "Patterson", "Crichton", "Tolkien", "Rowling", "Sparks", "Picoult", "Lamb"]
+
+CITIES = ["new york", "london", "toronto", "barcelona", "berlin", "sydney", "lisboa", "madrid", "chicago", "seattle",
+          "paris", "milano", "porto", "ottawa", "san diego", "köln"]
+COUNTRIES = ["usa", "united kingdom", "canada", "spain", "germany", "australia", "portugal", "france", "italy"]
+
+
+# Weights of a power law, the first value is the most common one
+def _power_law(count, exponent):
+    weights = 1 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+# Random ISBN-10s without duplicates, with the right check digit
+def _isbns(rng, count):
+
+    values = np.unique(rng.integers(0, 10 ** 9, int(count * 1.1) + 10))
+    values = rng.permutation(values)[:count]
+
+    digits = values[:, None] // 10 ** np.arange(8, -1, -1) % 10
+    check = (11 - (digits * np.arange(10, 1, -1)).sum(axis=1) % 11) % 11
+
+    return np.char.add(np.char.zfill(values.astype(str), 9), np.where(check == 10, "X", check.astype(str)))
+
+
+# Words of two or three syllables
+def _words(rng, count):
+
+    syllables = rng.integers(0, len(SYLLABLES), (count, 3))
+    lengths = rng.integers(2, 4, count)
+
+    return np.array(["".join(SYLLABLES[s] for s in word[:length]).capitalize()
+                     for word, length in zip(syllables, lengths)])
+
+
+# Titles of a few words: common words, words whose use follows a power law and sometimes a series or a subtitle
+def _titles(rng, count, vocabulary_size):
+
+    vocabulary = _words(rng, vocabulary_size).tolist()
+
+    word_counts = np.minimum(rng.poisson(3, count) + 1, 15)
+    common = rng.random(word_counts.sum()) < 0.3
+    words = np.where(common, rng.integers(0, len(COMMON_WORDS), len(common)),
+                     rng.choice(vocabulary_size, len(common), p=_power_law(vocabulary_size, 1.1)))
+    offsets = np.concatenate(([0], np.cumsum(word_counts)))
+    extras = rng.random(count)
+
+    titles = []
+    for i in range(count):
+        title = " ".join(COMMON_WORDS[word] if is_common else vocabulary[word]
+                         for word, is_common in zip(words[offsets[i]:offsets[i + 1]], common[offsets[i]:offsets[i + 1]]))
+
+        if extras[i] < 0.05:
+            title += " (%s Series, Book %d)" % (vocabulary[words[offsets[i]] % vocabulary_size], i % 9 + 1)
+        elif extras[i] < 0.1:
+            title += ": A Novel"
+
+        titles.append(title)
+
+    return titles
+
+
+def _books(rng, count):
+
+    isbns = _isbns(rng, count)
+
+    # Many authors have a book or two, a few have hundreds
+    author_count = max(count // 4, 1)
+    surnames = np.where(rng.random(author_count) < 0.2, rng.choice(LAST_NAMES, author_count),
+                        _words(rng, author_count))
+    names = np.char.add(np.char.add(rng.choice(FIRST_NAMES, author_count), " "), surnames)
+    authors = names[rng.choice(author_count, count, p=_power_law(author_count, 0.9))]
+    authors = np.where(rng.random(count) < 0.03, np.char.upper(authors), authors)
+
+    # Most books are recent, some have no year (0) and a few have a year in the future
+    years = np.maximum(2004 - rng.exponential(12, count).astype(int), 1900)
+    years = np.where(rng.random(count) < 0.015, 0, years)
+    years = np.where(rng.random(count) < 0.0005, rng.integers(2005, 2040, count), years)
+
+    publisher_count = max(count // 16, 1)
+    publishers = np.char.add("Publisher ", rng.choice(publisher_count, count, p=_power_law(publisher_count, 1.0))
+                             .astype(str))
+
+    urls = ["http://images.amazon.com/images/P/" + isbn + ".01.%sZZZ.jpg" for isbn in isbns]
+
+    return pd.DataFrame({
+        "ISBN": isbns,
+        "Book-Title": _titles(rng, count, max(int(count ** 0.8), 100)),
+        "Book-Author": authors,
+        "Year-Of-Publication": years,
+        "Publisher": publishers,
+        "Image-URL-S": [url % "THUMB" for url in urls],
+        "Image-URL-M": [url % "MZZZZ" for url in urls],
+        "Image-URL-L": [url % "LZZZZ" for url in urls],
+    })
+
+
+def _users(rng, count):
+
+    locations = np.char.add(np.char.add(rng.choice(CITIES, count), ", , "), rng.choice(COUNTRIES, count))
+    ages = np.clip(rng.normal(35, 13, count), 5, 100).astype(int).astype(str)
+
+    return pd.DataFrame({
+        "User-ID": np.arange(1, count + 1).astype(str),
+        "Location": locations,
+        "Age": np.where(rng.random(count) < 0.4, "NULL", ages),
+    })
+
+
+# Ratings per user and per book follow power laws, so most of them rate or are rated a few times
+def _ratings(rng, user_ids, isbns, count):
+
+    user_weights = _power_law(len(user_ids), 1.0)[rng.permutation(len(user_ids))]
+    book_weights = _power_law(len(isbns), 0.9)[rng.permutation(len(isbns))]
+
+    # A user rates a book once, so pairs are drawn until there are enough different ones
+    pairs = np.zeros(0, dtype=np.int64)
+    while len(pairs) < count:
+        users = rng.choice(len(user_ids), count, p=user_weights)
+        books = rng.choice(len(isbns), count, p=book_weights)
+        pairs = np.unique(np.concatenate((pairs, users.astype(np.int64) * len(isbns) + books)))
+
+    # Ratings of a user are together, like in the Book-Crossing dataset
+    pairs = np.sort(rng.permutation(pairs)[:count])
+    users, books = pairs // len(isbns), pairs % len(isbns)
+
+    book_isbns = isbns[books]
+    unknown = rng.random(len(books)) < UNKNOWN_ISBNS
+    book_isbns[unknown] = _isbns(rng, int(unknown.sum()))
+
+    return pd.DataFrame({
+        "User-ID": user_ids[users],
+        "ISBN": book_isbns,
+        "Book-Rating": rng.choice(RATING_VALUES, len(books), p=RATING_WEIGHTS / RATING_WEIGHTS.sum()),
+    })
+
+
+# Users, books and ratings files like the ones of Book-Crossing: ';' between the quoted values and ISO-8859-1
+# Scale 1 is about the size of Book-Crossing, scale 10 is ten times bigger
+# Returns the names of the users, books and ratings files and the amount of rows of every file
+def generate(directory, scale=1.0, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    users = _users(rng, max(int(BX_USERS * scale), 10))
+    books = _books(rng, max(int(BX_BOOKS * scale), 10))
+    ratings = _ratings(rng, users["User-ID"].values, books["ISBN"].values, max(int(BX_RATINGS * scale), 100))
+
+    files = [os.path.join(directory, file_name) for file_name in ["BX-Users.csv", "BX-Books.csv", "BX-Book-Ratings.csv"]]
+    for file_name, df in zip(files, [users, books, ratings]):
+        df.to_csv(file_name, index=False, sep=';', encoding='ISO-8859-1', quoting=csv.QUOTE_ALL)
+
+    return files, {"users": len(users), "books": len(books), "ratings": len(ratings)}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Users, books and ratings files like the ones of Book-Crossing")
+    parser.add_argument("directory", help="directory of the files")
+    parser.add_argument("--scale", type=float, default=1.0, help="1 is about the size of Book-Crossing")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    _, sizes = generate(arguments.directory, arguments.scale, arguments.seed)
+    print("%(users)d users, %(books)d books and %(ratings)d ratings are saved" % sizes)
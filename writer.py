@@ -0,0 +1,160 @@
+import json  # For JSON lines
+import os  # For the directories of the legacy files
+import sqlite3  # For the SQLite output
+from pathlib import Path  # Path of the legacy files
+
+# Users whose records are kept in memory before they are written together
+BUFFER_SIZE = 1000
+
+# Overlaps of a record and the name of their legacy file
+LEGACY_OVERLAPS = [("jaccard_dice", "jaccard & dice"), ("golden_jaccard", "golden & jaccard"),
+                   ("golden_dice", "golden & dice")]
+
+
+# Suggestions and overlaps of every user in a single file, a buffer of users at a time
+# A record is the user, the jaccard, dice and golden lists and the overlaps, like main.user_record returns it
+# If legacy is given, every record is also given to it
+class _Writer:
+
+    def __init__(self, buffer_size=BUFFER_SIZE, legacy=None):
+
+        self.buffer_size = buffer_size
+        self.legacy = legacy
+        self.buffer = []
+        self.records = 0
+
+    def add(self, record):
+
+        self.buffer.append(record)
+        self.records += 1
+
+        if self.legacy is not None:
+            self.legacy.add(record)
+
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+
+        if self.buffer:
+            self._write(self.buffer)
+            self.buffer = []
+
+    def close(self):
+
+        self.flush()
+        self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+# A JSON line for every user
+class JsonLinesWriter(_Writer):
+
+    def __init__(self, file_name, buffer_size=BUFFER_SIZE, legacy=None):
+
+        super().__init__(buffer_size, legacy)
+        self.file = open(file_name, "w", encoding="utf-8")
+
+    def _write(self, records):
+        self.file.write("".join(json.dumps(record) + "\n" for record in records))
+
+    def _close(self):
+        self.file.close()
+
+
+# Two tables: suggestions has a row for every book of every list and overlaps a row for every overlap
+# Every buffer is a single transaction
+class SQLiteWriter(_Writer):
+
+    def __init__(self, file_name, buffer_size=BUFFER_SIZE, legacy=None):
+
+        super().__init__(buffer_size, legacy)
+
+        if os.path.exists(file_name):
+            os.remove(file_name)
+
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute("CREATE TABLE suggestions (user TEXT, metric TEXT, position INTEGER, isbn TEXT, "
+                                "result REAL, times INTEGER)")
+        self.connection.execute("CREATE TABLE overlaps (user TEXT, pair TEXT, overlap REAL)")
+
+    def _write(self, records):
+
+        suggestions, overlaps = [], []
+
+        for record in records:
+            for metric in ["jaccard", "dice"]:
+                suggestions.extend((record["user"], metric, position + 1, isbn, result, None)
+                                   for position, (isbn, result) in enumerate(record[metric]))
+
+            suggestions.extend((record["user"], "golden", position + 1, isbn, result, times)
+                               for position, (isbn, times, result) in enumerate(record["golden"]))
+
+            overlaps.extend((record["user"], pair, value) for pair, value in record["overlap"].items())
+
+        with self.connection:
+            self.connection.executemany("INSERT INTO suggestions VALUES (?, ?, ?, ?, ?, ?)", suggestions)
+            self.connection.executemany("INSERT INTO overlaps VALUES (?, ?, ?)", overlaps)
+
+    def _close(self):
+
+        with self.connection:
+            self.connection.execute("CREATE INDEX suggestions_user ON suggestions (user)")
+        self.connection.close()
+
+
+# Old layout: results/user-N-jaccard.txt and results/user-N-dice.txt with the suggested books
+# and overlaps/user-N jaccard & dice and the rest with the overlaps, N is the number of the record
+class LegacyWriter:
+
+    def __init__(self, data):
+
+        self.data = data
+        self.records = 0
+
+        # Create directories named results and overlaps if they do not exist
+        for directory in ["results/", "overlaps/"]:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+    def add(self, record):
+
+        user_index = str(self.records)
+        self.records += 1
+
+        for metric in ["jaccard", "dice"]:
+            books = [self.data.book_record(self.data.isbn_index[isbn]) for isbn, _ in record[metric]]
+
+            with open(Path("results/") / ("user-" + user_index + "-" + metric + ".txt"), 'w') as f:
+                f.write("".join("ISBN: %s \t with title: %s\nAuthor is: %s and year is %s\n" % tuple(book)
+                                for book in books))
+
+        for pair, name in LEGACY_OVERLAPS:
+            with open(Path("overlaps/") / ("user-" + user_index + " " + name), 'w') as f:
+                f.write("Overlap of user %s is  => %.1f\n" % (user_index, record["overlap"][pair]))
+
+
+# SQLite for .db and .sqlite files, JSON lines for anything else
+def open_writer(file_name, buffer_size=BUFFER_SIZE, legacy=None):
+
+    directory = os.path.dirname(file_name)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    if file_name.endswith((".db", ".sqlite")):
+        return SQLiteWriter(file_name, buffer_size, legacy)
+
+    return JsonLinesWriter(file_name, buffer_size, legacy)
+
+
+# Records of a JSON lines file, for example to merge shards
+def read_records(file_name):
+
+    with open(file_name, encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)